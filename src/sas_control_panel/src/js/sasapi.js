@@ -114,7 +114,9 @@
     }
 
     sasapi.ClientRequest = class {
-        constructor(timeoutSeconds = 15) {
+        constructor(timeoutSeconds = 15, on_progress = null) {
+            this.timeoutSeconds = timeoutSeconds;
+            this.on_progress = on_progress;
             this.promise = new Promise((resolve, reject) => {
                 this._resolve = resolve;
                 this._reject = reject;
@@ -125,6 +127,17 @@
             });
         }
 
+        /**
+         * An intermediate frame arrived, the request is still alive.
+         */
+        progress(value) {
+            clearTimeout(this.timeoutID);
+            this.timeoutID = setTimeout(() => {
+                this.reject();
+            }, this.timeoutSeconds * 1000);
+            if(this.on_progress !== null) this.on_progress(value);
+        }
+
         resolve(value) {
             clearTimeout(this.timeoutID);
             this._resolve(value);
@@ -140,8 +153,10 @@
         constructor(username, password) {
             this.username = username;
             this.password = password;
+            this.token = null;
             this.ws = null;
             this.requests = {};
+            this.subscriptions = {};
         }
 
         /**
@@ -168,7 +183,11 @@
                 this.on_message(evt);
             });
 
-            this.ws.addEventListener("open", callback);
+            this.ws.addEventListener("open", async (evt) => {
+                // Get a session token, so the password is not checked on every request
+                if(this.username && this.password) await this.users_login();
+                if(callback) callback(evt);
+            });
         }
 
         /**
@@ -183,22 +202,82 @@
          */
         on_message(evt) {
             var msg = JSON.parse(evt.data);
+            if(msg.hasOwnProperty("change")) {
+                if(this.subscriptions.hasOwnProperty(msg.id)) this.subscriptions[msg.id](msg.change);
+                return;
+            }
             if(this.requests.hasOwnProperty(msg.id)) {
+                if(msg.hasOwnProperty("progress")) {
+                    this.requests[msg.id].progress(msg.progress);
+                    return;
+                }
+                if(msg.more === true) {
+                    // A chunk of a streamed listing
+                    this.requests[msg.id].progress(msg.results);
+                    return;
+                }
                 this.requests[msg.id].resolve(msg);
                 delete this.requests[msg.id];
             }
         }
 
-        async send_and_wait(req) {
-            const mid = this.generateID();
+        async send_and_wait(req, on_progress = null) {
+            const mid = req.hasOwnProperty("id") ? req.id : this.generateID();
             req.id = mid;
-            req.username = this.username;
-            req.password = this.password;
+            if(this.token !== null) {
+                req.token = this.token;
+            }
+            else {
+                req.username = this.username;
+                req.password = this.password;
+            }
             this.ws.send(JSON.stringify(req));
 
-            const request = new sasapi.ClientRequest();
+            const request = new sasapi.ClientRequest(15, on_progress);
             this.requests[mid] = request;
-            return await request.promise;
+            const resp = await request.promise;
+
+            // The session expired (or the daemon restarted), sign in again and retry
+            if(resp.error === "invalid-token") {
+                delete req.token;
+                this.token = null;
+                await this.users_login();
+                return await this.send_and_wait(req, on_progress);
+            }
+            return resp;
+        }
+
+        /**
+         * Apply several add/alter/remove actions of templates, people and rules in a single transaction.
+         * @param {Array} actions [{action: ["people", "alter"], parameters: {...}}, ...]
+         * @returns The response of each action, or null if the batch was rolled back.
+         */
+        async batch(actions) {
+            const resp = await this.send_and_wait({
+                actions: actions
+            });
+
+            return (resp.hasOwnProperty("results") ? resp.results : null);
+        }
+
+        /**
+         * Receive the changes of objects as they happen, instead of fetching the lists again.
+         * @param {Function} on_change Called with every change: {object, event: "created"|"updated"|"deleted", id, fields}.
+         * @param {Array} objects Any of "template", "people", "rule", null for all of them.
+         * @returns true if the subscription was accepted.
+         */
+        async subscribe(on_change, objects = null) {
+            const mid = this.generateID();
+            this.subscriptions[mid] = on_change;
+            const resp = await this.send_and_wait({
+                id: mid,
+                action: ["subscribe"],
+                parameters: (objects === null ? {} : {objects: objects})
+            });
+
+            const success = resp.hasOwnProperty("status") && resp.status == "success";
+            if(!success) delete this.subscriptions[mid];
+            return success;
         }
 
         async common_get(object_converter, object_name, id = null, limit = null, offset = null) {
@@ -220,6 +299,27 @@
             return res;
         }
 
+        async common_page(object_converter, object_name, limit, cursor = null, filters = {}) {
+            const data = await this.send_and_wait({
+                action: [object_name, 'get'],
+                parameters: Object.assign({limit: limit}, filters, cursor)
+            });
+
+            return {
+                results: data.results.map((item) => object_converter.fromJSON(item)),
+                next_cursor: data.next_cursor
+            };
+        }
+
+        async common_stream(object_converter, object_name, on_chunk, filters = {}) {
+            const data = await this.send_and_wait({
+                action: [object_name, 'get'],
+                parameters: Object.assign({stream: true}, filters)
+            }, (chunk) => on_chunk(chunk.map((item) => object_converter.fromJSON(item))));
+
+            return (data.hasOwnProperty("count") ? data.count : null);
+        }
+
         async common_add(object_name, params) {
             const resp = await this.send_and_wait({
                 action: [object_name, "add"],
@@ -261,6 +361,27 @@
             return await this.common_get(sasapi.Template, "template", id, limit, offset);
         }
 
+        /**
+         * Fetch a page of templates.
+         * @param {int} limit The maximum templates to return.
+         * @param {Object} cursor The next_cursor of the previous page, null for the first page.
+         * @param {Object} filters {sort: "id"|"label", label_prefix: string}, pass the same filters for every page.
+         * @returns {results: Array of Templates, next_cursor: Object or null on the last page}
+         */
+        async template_page(limit, cursor = null, filters = {}) {
+            return await this.common_page(sasapi.Template, "template", limit, cursor, filters);
+        }
+
+        /**
+         * Fetch all templates in chunks, without waiting for (or keeping) the whole list.
+         * @param {Function} on_chunk Called with an Array of Templates for every received chunk.
+         * @param {Object} filters See template_page, "limit" may be used too.
+         * @returns The number of received templates, null on failure.
+         */
+        async template_stream(on_chunk, filters = {}) {
+            return await this.common_stream(sasapi.Template, "template", on_chunk, filters);
+        }
+
         async template_add(template) {
             return await this.common_add("template", {
                 label: template.label,
@@ -285,6 +406,18 @@
             return await this.common_get(sasapi.PersonTemplateArguments, "people", id, limit, offset);
         }
 
+        /**
+         * Fetch a page of people, see template_page.
+         * Filters: {sort: "id"|"first_name"|"last_name"|"telephone", name_prefix: string, telephone_prefix: string}
+         */
+        async people_page(limit, cursor = null, filters = {}) {
+            return await this.common_page(sasapi.PersonTemplateArguments, "people", limit, cursor, filters);
+        }
+
+        async people_stream(on_chunk, filters = {}) {
+            return await this.common_stream(sasapi.PersonTemplateArguments, "people", on_chunk, filters);
+        }
+
         async people_add(person) {
             return await this.common_add("people", {
                 first_name: person.args.first_name,
@@ -308,10 +441,41 @@
             return await this.common_remove("people", id);
         }
 
+        /**
+         * Import many people at once.
+         * @param {string} data CSV (with a header line) or NDJSON text.
+         * @param {string} format Either "csv" or "ndjson".
+         * @param {Function} on_progress Called with {processed, imported, rejected} after every inserted chunk.
+         * @returns The import result ({processed, imported, rejected, id_ranges, errors}) or null on failure.
+         */
+        async people_import(data, format = "csv", on_progress = null) {
+            const resp = await this.send_and_wait({
+                action: ["people", "import"],
+                parameters: {
+                    data: data,
+                    format: format
+                }
+            }, on_progress);
+
+            return (resp.hasOwnProperty("imported") ? resp : null);
+        }
+
         async rule_get(id = null, limit = null, offset = null) {
             return await this.common_get(sasapi.SendMessageRule, "rule", id, limit, offset);
         }
 
+        /**
+         * Fetch a page of rules, see template_page.
+         * Filters: {sort: "id"|"label", label_prefix: string}
+         */
+        async rule_page(limit, cursor = null, filters = {}) {
+            return await this.common_page(sasapi.SendMessageRule, "rule", limit, cursor, filters);
+        }
+
+        async rule_stream(on_chunk, filters = {}) {
+            return await this.common_stream(sasapi.SendMessageRule, "rule", on_chunk, filters);
+        }
+
         async rule_add(obj) {
             return await this.common_add("rule", {
                 label: obj.label,
@@ -342,19 +506,28 @@
         }
 
         async users_login() {
+            this.token = null;
             var resp = await this.send_and_wait({
                 action: ["users", "login"],
                 parameters: {}
             });
 
+            if(resp.hasOwnProperty("token")) this.token = resp.token;
             return (resp.hasOwnProperty("status") && resp.status === "success");
         }
 
         async users_alter(new_username, new_password) {
-            return await this.common_alter("users", {
-                new_username: new_username,
-                new_password: new_password
+            const resp = await this.send_and_wait({
+                action: ["users", "alter"],
+                parameters: {
+                    new_username: new_username,
+                    new_password: new_password
+                }
             });
+
+            // All sessions of the user are revoked, keep using the new one
+            if(resp.hasOwnProperty("token")) this.token = resp.token;
+            return resp.hasOwnProperty("status") && resp.status == "success";
         }
 
         async timezone_get() {
@@ -404,5 +577,36 @@
                 "telephone": telephone
             });
         }
+
+        /**
+         * The pool of sender numbers.
+         * @returns {Promise<string[]>}
+         */
+        async telephones_get() {
+            var resp = await this.send_and_wait({
+                action: ["telephone", "get"],
+                parameters: {}
+            });
+
+            return resp.hasOwnProperty("telephones") ? resp.telephones : [];
+        }
+
+        async telephone_add(telephone) {
+            const resp = await this.send_and_wait({
+                action: ["telephone", "add"],
+                parameters: {"telephone": telephone}
+            });
+
+            return resp.hasOwnProperty("status") && resp.status == "success";
+        }
+
+        async telephone_remove(telephone) {
+            const resp = await this.send_and_wait({
+                action: ["telephone", "remove"],
+                parameters: {"telephone": telephone}
+            });
+
+            return resp.hasOwnProperty("status") && resp.status == "success";
+        }
     }
 }(window.sasapi = window.sasapi || {}))
\ No newline at end of file
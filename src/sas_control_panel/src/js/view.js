@@ -64,6 +64,87 @@ async function delete_action(object_name) {
 }
 
 
+/**
+ * Fetch the items of the page, or a single one.
+ * @param {int} id The ID of the item to fetch, null for all items (and the header).
+ * @returns Array of DOMListItems
+ */
+async function fetch_items(id = null) {
+    let temp_items = [];
+    var items = [];
+
+    switch (page_object_type) {
+        case "template":
+            temp_items = await client.template_get(id);
+            if(id === null) items.push(new domlist.TemplateDOMListItem(null));
+            for (let i = 0; i < temp_items.length; i++) {
+                const item_obj = temp_items[i];
+                items.push(new domlist.TemplateDOMListItem(item_obj));
+            }
+            break;
+
+        case "people":
+            temp_items = await client.people_get(id);
+            if(id === null) items.push(new domlist.PeopleDOMListItem(null));
+            for (let i = 0; i < temp_items.length; i++) {
+                const item_obj = temp_items[i];
+                items.push(new domlist.PeopleDOMListItem(item_obj));
+            }
+            break;
+
+        case "rule":
+            temp_items = await client.rule_get(id);
+            if(id === null) items.push(new domlist.RuleDOMListItem(null));
+            for (let i = 0; i < temp_items.length; i++) {
+                const item_obj = temp_items[i];
+                items.push(new domlist.RuleDOMListItem(item_obj));
+            }
+            break;
+    }
+    return items;
+}
+
+
+function item_id(item) {
+    if(item.obj === null) return null;
+    return (page_object_type == "people" ? item.obj.args.id : item.obj.id);
+}
+
+
+/**
+ * Update the list with a change received from the API.
+ * @param {domlist.DOMList} dlist The list of the page
+ * @param {Object} change The change ({object, event, id, fields})
+ */
+async function apply_change(dlist, change) {
+    if(change.id === null) {
+        // Many objects were created at once, fetch everything again
+        dlist.items = await fetch_items();
+        return;
+    }
+
+    const index = dlist.items.findIndex((item) => item_id(item) === change.id);
+    if(change.event == "deleted") {
+        if(index !== -1) dlist.items.splice(index, 1);
+        return;
+    }
+
+    const fetched = await fetch_items(change.id);
+    if(fetched.length == 0) return;
+    if(index === -1) dlist.items.push(fetched[0]);
+    else dlist.items[index] = fetched[0];
+}
+
+
+/**
+ * Rendering unchecks every item, reset the buttons to match.
+ */
+function reset_action_buttons() {
+    document.getElementsByClassName("edit-button")[0].setAttribute("disabled", '');
+    document.getElementsByClassName("delete-button")[0].setAttribute("disabled", '');
+}
+
+
 /**
  * The entry point of the script.
  */
@@ -95,40 +176,14 @@ document.addEventListener("DOMContentLoaded", () => {
     });
 
     client.connect(async (evt) => {
-        let temp_items = [];
-        var items = [];
-
-        switch (page_object_type) {
-            case "template":
-                temp_items = await client.template_get();
-                items.push(new domlist.TemplateDOMListItem(null));
-                for (let i = 0; i < temp_items.length; i++) {
-                    const item_obj = temp_items[i];
-                    items.push(new domlist.TemplateDOMListItem(item_obj));
-                }
-                break;
-
-            case "people":
-                temp_items = await client.people_get();
-                items.push(new domlist.PeopleDOMListItem(null));
-                for (let i = 0; i < temp_items.length; i++) {
-                    const item_obj = temp_items[i];
-                    items.push(new domlist.PeopleDOMListItem(item_obj));
-                }
-                break;
-
-            case "rule":
-                temp_items = await client.rule_get();
-                items.push(new domlist.RuleDOMListItem(null));
-                for (let i = 0; i < temp_items.length; i++) {
-                    const item_obj = temp_items[i];
-                    items.push(new domlist.RuleDOMListItem(item_obj));
-                }
-                break;
-        }
-        delete temp_items;
-
-        dlist.add_items(items);
+        dlist.add_items(await fetch_items());
         dlist.render(set_action_buttons_state);
+
+        // Keep the list up to date without fetching it again
+        await client.subscribe(async (change) => {
+            await apply_change(dlist, change);
+            dlist.render(set_action_buttons_state);
+            reset_action_buttons();
+        }, [page_object_type]);
     });
-});
\ No newline at end of file
+});
@@ -18,7 +18,6 @@ for the "Daemon" component of the project (SAS).
 '''
 import argon2
 
-COLLECT_RULES_INTERVAL = 60
 DATABASE_FILE = "temp.db"
 API_ADDRESS = "0.0.0.0"
 API_PORT = 8585
@@ -26,9 +25,56 @@ DEFAULT_TIMEZONE = "UTC"
 
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
 
+DATABASE_WAL = True # Use write-ahead logging, allows reading while a write is in progress
+DATABASE_SYNCHRONOUS = "NORMAL" # Safe with WAL, only the last transactions may be lost on power loss
+DATABASE_CACHE_SIZE = -16384 # Page cache size in KiB (negative) or pages (positive)
+DATABASE_MMAP_SIZE = 256 * 1024 * 1024 # Bytes of the database file accessed through mmap
+DATABASE_BUSY_TIMEOUT = 5000 # Milliseconds to wait for a lock before failing
+DATABASE_READERS = 4 # Read-only connections serving the WebSocket API
+DATABASE_FETCH_CHUNK_SIZE = 1000 # Rows fetched at a time when streaming query results
+WSAPI_STREAM_CHUNK_SIZE = 500 # Results per frame of a streamed WebSocket API listing
+WSAPI_CONNECTION_CONCURRENCY = 16 # Requests handled at the same time per WebSocket connection
+CHANGEFEED_QUEUE_SIZE = 1000 # Change events that may wait for a subscriber before it is disconnected
+
+TEMPLATE_CACHE_SIZE = 1024 # Parsed templates kept in memory
+PERSON_CACHE_SIZE = 65536 # People kept in memory
+
+IMPORT_CHUNK_SIZE = 5000 # People inserted per transaction by bulk imports
+IMPORT_MAX_ERRORS = 100 # Rejected rows reported back in detail
+
+OUTBOX_BATCH_SIZE = 100 # Messages taken from the outbox at a time
+OUTBOX_POLL_INTERVAL = 5.0 # Seconds between checks of the outbox when it is idle
+OUTBOX_MAX_ATTEMPTS = 5 # Attempts to send a message before giving up on it
+OUTBOX_RETRY_DELAY = 30 # Seconds before retrying a failed message, doubled after every failed attempt
+OUTBOX_RETRY_MAX_DELAY = 60 * 60 # Most seconds between the attempts of a message
+OUTBOX_RETENTION = 30 * 24 * 60 * 60 # Seconds sent and failed messages are kept in the outbox
+OUTBOX_PURGE_INTERVAL = 60 * 60 # Seconds between removals of old messages from the outbox
+
+CATCHUP_POLICY = "once" # Executions missed while the daemon was down: "once" fires them once, "skip" drops them, "all" fires each
+CATCHUP_RATE = 5.0 # Overdue rules fired per second on startup
+CATCHUP_WINDOW = 300 # Seconds to fire all overdue rules in, CATCHUP_RATE is raised if needed (0 for no limit)
+CATCHUP_MAX_FIRINGS = 100 # Most missed executions fired per rule by the "all" policy
+RULE_RETRY_DELAY = 60 # Seconds before a rule whose execution failed is fired again
+
+SMS_DISPATCH_CONCURRENCY = 8 # Messages sent at the same time
+SMS_RATE_LIMIT = 1.0 # Messages per second of each sender number (0 for no limit)
+SMS_RATE_BURST = 1 # Messages a sender number may send at once after being idle
+SMS_RATE_LIMITS:dict[str, tuple[float, int]] = {} # {sender number: (messages per second, burst)} overriding the above
+SMS_RATE_QUEUE_SIZE = 1000 # Messages that may wait for the rate limit of a sender number
+SMS_GATEWAY = "telnyx" # The gateway messages are sent through: "telnyx" or "http" (see api/HTTPGateway.py, e.g. sas-mock-gateway)
+SMS_GATEWAY_URL = "http://127.0.0.1:8686" # Address of the "http" gateway
+TELNYX_BATCH_SIZE = 8 # Telnyx requests made at the same time by a batch
+HTTP_GATEWAY_BATCH_SIZE = 100 # Messages per request of the "http" gateway
+HTTP_GATEWAY_TIMEOUT = 30 # Seconds to wait for a response of the "http" gateway
+SENDER_POOL_POLICY = "sticky" # Sender number of a recipient: "sticky" (always the same one) or "least_loaded"
+
 PASSWORD_TIME_COST = argon2.DEFAULT_TIME_COST # 3
 PASSWORD_MEMORY_COST = argon2.DEFAULT_MEMORY_COST # 65536
 PASSWORD_PARALLELISM = argon2.DEFAULT_PARALLELISM # 4
+PASSWORD_HASH_WORKERS = 2 # Passwords hashed/verified at the same time
+
+SESSION_LIFETIME = 12 * 60 * 60 # Seconds a session token is valid
+SESSION_PURGE_INTERVAL = 60 # Seconds between removals of expired sessions
 
 DATABASE_TIMEZONE_SETTING = "timezone"
 DATABASE_APIKEY_SETTING = "api-key"
@@ -13,11 +13,68 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 '''
+from __future__ import annotations
+from email.utils import parsedate_to_datetime
+import asyncio
+import time
 
 
 
 
+class GatewayError(Exception):
+    """The gateway didn't accept a message."""
+
+
+class RateLimitedError(GatewayError):
+    def __init__(self, message:str, retry_after:float|None = None):
+        """The gateway throttled the sender, the message may be sent again after `retry_after` seconds (None if unknown)."""
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @staticmethod
+    def parse_retry_after(value:str|None) -> float|None:
+        """Seconds to wait according to a Retry-After header (seconds or an HTTP date), None if it's missing or invalid."""
+        if not value:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+
 class BasicAPI:
+    # The number messages are sent from, the messages of a sender share its rate limit
+    sender:str|None = None
+    # Most messages passed to a single send_many call
+    max_batch:int = 1
+
+    def pick(self, telephone:str) -> BasicAPI:
+        """The gateway that sends the messages of `telephone` (see SenderPool)."""
+        return self
 
     def sendSMS(self, telephone:str, message:str):
-        raise NotImplementedError(f"{self.__class__.__qualname__}.sendSMS: Not Implemented!")
\ No newline at end of file
+        raise NotImplementedError(f"{self.__class__.__qualname__}.sendSMS: Not Implemented!")
+
+    def _send_each(self, messages:list[tuple[str, str]]) -> list[BaseException|None]:
+        results:list[BaseException|None] = []
+        for telephone, message in messages:
+            try:
+                self.sendSMS(telephone, message)
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def send_many(self, messages:list[tuple[str, str]]) -> list[BaseException|None]:
+        """Send (telephone, message) pairs, at most `max_batch` of them.
+
+        The default calls sendSMS for each message in a worker thread.
+
+        Returns:
+            list[BaseException | None]: The error of each message, None if it was sent.
+        """
+        return await asyncio.to_thread(self._send_each, messages)
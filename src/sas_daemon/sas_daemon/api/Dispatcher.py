@@ -0,0 +1,89 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from .BasicAPI import BasicAPI
+from .RateLimiter import RateLimiter
+from .. import Constants
+import asyncio
+
+class SMSDispatcher:
+    def __init__(self, concurrency:int = Constants.SMS_DISPATCH_CONCURRENCY, limiter:RateLimiter|None = None):
+        """Sends messages through the gateways' send_many, at most `concurrency` calls at a time.
+
+        Messages are sent in batches of a single sender (see SenderPool), a batch is at most
+        the gateway's max_batch and its sender's rate limit burst.
+
+        Args:
+            concurrency (int, optional): Number of gateway calls made at the same time.
+            limiter (RateLimiter | None, optional): Rate limits of the senders, a default RateLimiter if None.
+        """
+        self.concurrency = concurrency
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self._calls = asyncio.Semaphore(concurrency)
+        self._in_flight:dict[str|None, int] = {} # {sender: messages that are being sent}
+
+    def load(self, sender:str|None) -> int:
+        """The number of messages of `sender` that are being sent."""
+        return self._in_flight.get(sender, 0)
+
+    def _add_load(self, sender:str|None, count:int):
+        load = self._in_flight.get(sender, 0) + count
+        if load:
+            self._in_flight[sender] = load
+        else:
+            self._in_flight.pop(sender, None)
+
+    async def _send_chunk(self, gateway:BasicAPI, messages:list[tuple[str, str]]) -> list[BaseException|None]:
+        sender = gateway.sender
+        self._add_load(sender, len(messages))
+        try:
+            # Tokens are taken once the call can be made, a chunk held back by the concurrency
+            # limit must not go out together with the ones after it
+            async with self._calls:
+                for _ in messages:
+                    await self.limiter.acquire(sender)
+                results = await gateway.send_many(messages)
+            if len(results) != len(messages):
+                raise RuntimeError(f"{gateway!r}.send_many returned {len(results)} results for {len(messages)} messages")
+            return results
+        except Exception as e:
+            return [e] * len(messages)
+        finally:
+            self._add_load(sender, -len(messages))
+
+    async def send_batch(self, gateway:BasicAPI, messages:list[tuple[str, str]]) -> list[BaseException|None]:
+        """Send (telephone, message) pairs in batches and wait until all of them are done.
+
+        Returns:
+            list[BaseException | None]: The error of each message, None if it was sent.
+        """
+        # Group the messages by the gateway (sender number) that sends them
+        groups:dict[int, tuple[BasicAPI, list[int]]] = {}
+        for index, (telephone, _) in enumerate(messages):
+            picked = gateway.pick(telephone)
+            groups.setdefault(id(picked), (picked, []))[1].append(index)
+
+        chunks:list[tuple[list[int], asyncio.Future]] = []
+        for picked, indexes in groups.values():
+            size = max(1, min(picked.max_batch, self.limiter.burst_of(picked.sender)))
+            for start in range(0, len(indexes), size):
+                chunk = indexes[start:start + size]
+                chunks.append((chunk, asyncio.ensure_future(self._send_chunk(picked, [messages[i] for i in chunk]))))
+
+        results:list[BaseException|None] = [None] * len(messages)
+        for chunk, future in chunks:
+            for index, result in zip(chunk, await future):
+                results[index] = result
+        return results
@@ -0,0 +1,82 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+This file (HTTPGateway.py) contains a gateway (HTTPGatewayAPI) which sends batches of messages
+to a JSON HTTP endpoint, such as the mock gateway of mockgateway.py.
+
+Request:  POST {url}/messages {"from": "...", "messages": [{"to": "...", "text": "..."}, ...]}
+Response: 200 {"results": [{"status": "sent", "id": "..."} or {"status": "failed", "error": "..."}, ...]}
+Any other status fails every message of the request, 429 (with an optional Retry-After header)
+fails them with a RateLimitedError.
+'''
+from __future__ import annotations
+from .BasicAPI import BasicAPI, GatewayError, RateLimitedError
+from .. import Constants
+import urllib.request
+import urllib.error
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger("sas.daemon.httpgateway")
+
+class HTTPGatewayAPI(BasicAPI):
+    max_batch = Constants.HTTP_GATEWAY_BATCH_SIZE
+
+    def __init__(self, url:str, api_key:str|None, from_number:str, timeout:float = Constants.HTTP_GATEWAY_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.api_key = api_key
+        self.from_number = from_number.replace(' ', '')
+        self.timeout = timeout
+        logger.info("%s", repr(self))
+
+    @property
+    def sender(self) -> str:
+        return self.from_number
+
+    def __repr__(self) -> str:
+        return "%s(url=%s, from_number=%s)" % (self.__class__.__qualname__, repr(self.url), repr(self.from_number))
+
+    def _post(self, messages:list[tuple[str, str]]) -> list[BaseException|None]:
+        body = json.dumps({"from": self.from_number, "messages": [{"to": telephone, "text": message} for telephone, message in messages]})
+        request = urllib.request.Request(self.url + "/messages", body.encode(), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        if self.api_key:
+            request.add_header("Authorization", f"Bearer {self.api_key}")
+
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                results = json.load(response)["results"]
+        except urllib.error.HTTPError as e:
+            if e.code == 429:
+                error = RateLimitedError(f"HTTP {e.code}: {e.reason}", RateLimitedError.parse_retry_after(e.headers.get("Retry-After")))
+            else:
+                error = GatewayError(f"HTTP {e.code}: {e.reason}")
+            return [error] * len(messages)
+        except (OSError, ValueError, KeyError) as e:
+            error = GatewayError(f"Request failed: {e}")
+            return [error] * len(messages)
+
+        if len(results) != len(messages):
+            return [GatewayError("The response doesn't match the request")] * len(messages)
+        return [None if result.get("status") == "sent" else GatewayError(result.get("error", "Unknown error")) for result in results]
+
+    def sendSMS(self, telephone:str, message:str):
+        error = self._post([(telephone, message)])[0]
+        if error is not None:
+            raise error
+
+    async def send_many(self, messages:list[tuple[str, str]]) -> list[BaseException|None]:
+        return await asyncio.to_thread(self._post, messages)
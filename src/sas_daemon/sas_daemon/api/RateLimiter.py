@@ -0,0 +1,131 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+This file (RateLimiter.py) contains the per sender rate limits of outbound messages,
+carriers reject or throttle the messages of a number that sends faster than allowed.
+'''
+from __future__ import annotations
+from .. import Constants
+import asyncio
+import time
+import logging
+
+logger = logging.getLogger("sas.daemon.dispatcher")
+
+
+class TokenBucket:
+    def __init__(self, rate:float, burst:int):
+        """`rate` tokens per second, at most `burst` of them saved up.
+
+        Tokens are reserved in order, the balance goes negative while messages wait for one.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self, now:float) -> float:
+        """Take a token and return the seconds until it is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class SenderLimit:
+    def __init__(self, rate:float, burst:int, queue_size:int):
+        """The token bucket, queue and figures of a single sender."""
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.queue = asyncio.Semaphore(queue_size)
+        self.queued = 0
+        self.max_queued = 0
+        self.sent = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.bucket.rate if self.bucket is not None else None,
+            "burst": self.bucket.burst if self.bucket is not None else None,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "sent": self.sent,
+            "delayed": self.delayed,
+            "avg_wait": self.total_wait / self.sent if self.sent else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class RateLimiter:
+    def __init__(self, rate:float = Constants.SMS_RATE_LIMIT, burst:int = Constants.SMS_RATE_BURST,
+                 queue_size:int = Constants.SMS_RATE_QUEUE_SIZE, limits:dict[str, tuple[float, int]]|None = None):
+        """Token bucket rate limits of every sender.
+
+        Each sender gets `rate` messages per second, or the (rate, burst) of `limits` if it's listed there.
+        Messages over the limit wait in the sender's queue, when `queue_size` messages are waiting
+        `acquire` also waits for a free place in the queue.
+
+        Args:
+            rate (float, optional): Messages per second of each sender, 0 for no limit.
+            burst (int, optional): Messages a sender may send at once after being idle.
+            queue_size (int, optional): Messages that may wait for a token per sender.
+            limits (dict[str, tuple[float, int]] | None, optional): {sender: (rate, burst)} of specific senders.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.queue_size = queue_size
+        self.limits = limits if limits is not None else dict(Constants.SMS_RATE_LIMITS)
+        self.senders:dict[str|None, SenderLimit] = {}
+
+    def _sender(self, sender:str|None) -> SenderLimit:
+        limit = self.senders.get(sender)
+        if limit is None:
+            rate, burst = self.limits.get(sender, (self.rate, self.burst)) if sender is not None else (self.rate, self.burst)
+            limit = self.senders[sender] = SenderLimit(rate, burst, self.queue_size)
+        return limit
+
+    def burst_of(self, sender:str|None) -> int:
+        """Messages `sender` may send at once, a large number if it isn't limited."""
+        bucket = self._sender(sender).bucket
+        return bucket.burst if bucket is not None else 2 ** 31
+
+    async def acquire(self, sender:str|None):
+        """Wait until `sender` may send a message."""
+        limit = self._sender(sender)
+        if limit.bucket is None:
+            limit.sent += 1
+            return
+
+        start = time.monotonic()
+        limit.queued += 1
+        limit.max_queued = max(limit.max_queued, limit.queued)
+        try:
+            async with limit.queue:
+                wait = limit.bucket.reserve(time.monotonic())
+                if wait > 0:
+                    await asyncio.sleep(wait)
+        finally:
+            limit.queued -= 1
+
+        waited = time.monotonic() - start
+        limit.sent += 1
+        limit.total_wait += waited
+        limit.max_wait = max(limit.max_wait, waited)
+        if waited > 0.001:
+            limit.delayed += 1
+
+    def stats(self) -> dict:
+        return {str(sender): limit.stats() for sender, limit in self.senders.items()}
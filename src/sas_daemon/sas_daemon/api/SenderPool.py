@@ -0,0 +1,97 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+This file (SenderPool.py) contains a gateway (SenderPool) which spreads the messages
+over many sender numbers, the throughput of a single number is capped by its carrier.
+'''
+from __future__ import annotations
+from typing import Callable
+from .BasicAPI import BasicAPI
+from .. import Constants
+import zlib
+
+STICKY = "sticky" # A recipient always gets its messages from the same number
+LEAST_LOADED = "least_loaded" # The number with the fewest messages in flight
+POLICIES = (STICKY, LEAST_LOADED)
+
+
+def _score(sender:str|None, telephone:str) -> int:
+    # crc32 is linear, the murmur3 finalizer makes the scores of different senders independent
+    h = zlib.crc32(f"{sender}:{telephone}".encode())
+    h = ((h ^ (h >> 16)) * 0x85ebca6b) & 0xffffffff
+    h = ((h ^ (h >> 13)) * 0xc2b2ae35) & 0xffffffff
+    return h ^ (h >> 16)
+
+
+class SenderPool(BasicAPI):
+    def __init__(self, gateways:list[BasicAPI], policy:str = Constants.SENDER_POOL_POLICY,
+                 load:Callable[[str|None], int]|None = None):
+        """Picks one of `gateways` (one per sender number) for every message.
+
+        STICKY uses rendezvous hashing on crc32("sender:recipient"), adding or removing a number
+        only moves the recipients of that number.
+
+        Args:
+            gateways (list[BasicAPI]): A gateway per sender number.
+            policy (str, optional): One of POLICIES.
+            load (Callable[[str | None], int] | None, optional): The messages in flight of a sender, required by LEAST_LOADED.
+        """
+        if not gateways:
+            raise ValueError(f"{self.__class__.__qualname__}: At least one gateway is needed")
+        if policy not in POLICIES:
+            raise ValueError(f"{self.__class__.__qualname__}: Unknown policy {policy!r}, expected one of {POLICIES}")
+        if policy == LEAST_LOADED and load is None:
+            raise ValueError(f"{self.__class__.__qualname__}: The {LEAST_LOADED} policy needs `load`")
+
+        self.gateways = gateways
+        self.policy = policy
+        self.load = load
+        self._next = 0
+
+    def __repr__(self) -> str:
+        return "%s(%s, policy=%s)" % (self.__class__.__qualname__, repr(self.gateways), repr(self.policy))
+
+    @staticmethod
+    def parse_numbers(value:str|None) -> list[str]:
+        """The sender numbers of the telephone setting, a comma separated list."""
+        if not value:
+            return []
+        numbers:list[str] = []
+        for number in value.split(','):
+            number = number.strip()
+            if number and number.replace(' ', '') not in (n.replace(' ', '') for n in numbers):
+                numbers.append(number)
+        return numbers
+
+    @staticmethod
+    def format_numbers(numbers:list[str]) -> str:
+        return ",".join(numbers)
+
+    def pick(self, telephone:str) -> BasicAPI:
+        if len(self.gateways) == 1:
+            return self.gateways[0]
+
+        if self.policy == STICKY:
+            return max(self.gateways, key=lambda g: _score(g.sender, telephone))
+
+        # Least loaded, ties are broken round robin
+        assert self.load is not None
+        count = len(self.gateways)
+        index = min(range(count), key=lambda i: (self.load(self.gateways[i].sender), (i - self._next) % count)) # type: ignore
+        self._next = (index + 1) % count
+        return self.gateways[index]
+
+    def sendSMS(self, telephone:str, message:str):
+        self.pick(telephone).sendSMS(telephone, message)
@@ -13,28 +13,58 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 '''
-from .BasicAPI import BasicAPI
+from .BasicAPI import BasicAPI, RateLimitedError
+from .. import Constants
+import asyncio
 import logging
 import telnyx
 
 logger = logging.getLogger("sas.daemon.telnyx")
 
 class TelnyxAPI(BasicAPI):
+    max_batch = Constants.TELNYX_BATCH_SIZE
+
     def __init__(self, api_key:str, from_number:str):
         self.api_key = api_key
         self.from_number = from_number.replace(' ', '')
         logger.info("%s", repr(self))
     
+    @property
+    def sender(self) -> str:
+        return self.from_number
+
     def __repr__(self) -> str:
         return "%s(api_key=%s, from_number=%s)" % (self.__class__.__qualname__, repr(self.api_key), repr(self.from_number))
 
+    @staticmethod
+    def rate_limited(e:Exception) -> RateLimitedError|None:
+        """A RateLimitedError if `e` is an HTTP 429 response of the API, None otherwise."""
+        # The error carries http_status/headers, newer SDKs status_code/response.headers
+        status = getattr(e, "http_status", None) or getattr(e, "status_code", None)
+        if status != 429:
+            return None
+        headers = getattr(e, "headers", None) or getattr(getattr(e, "response", None), "headers", None) or {}
+        return RateLimitedError(f"HTTP 429: {e}", RateLimitedError.parse_retry_after(headers.get("Retry-After")))
+
     def sendSMS(self, telephone:str, message:str):
         logger.info("SMS (%s): %s", telephone, message.replace('\n', '\\n'))
-        resp = telnyx.Message.create(
-            api_key = self.api_key,
-            from_   = self.from_number,
-            to      = telephone,
-            text    = message,
-            type    = "SMS"
-        )
-        logger.debug("%s.sendSMS(%s, %s) -> %s", repr(self), repr(message), repr(resp))
\ No newline at end of file
+        try:
+            resp = telnyx.Message.create(
+                api_key = self.api_key,
+                from_   = self.from_number,
+                to      = telephone,
+                text    = message,
+                type    = "SMS"
+            )
+        except Exception as e:
+            error = self.rate_limited(e)
+            if error is None:
+                raise
+            raise error from e
+        logger.debug("%s.sendSMS(%s, %s) -> %s", repr(self), repr(telephone), repr(message), repr(resp))
+
+    async def send_many(self, messages:list[tuple[str, str]]) -> list[BaseException|None]:
+        # The API takes a single message per request, the requests of a batch are made at the same time
+        results = await asyncio.gather(*(asyncio.to_thread(self.sendSMS, telephone, message) for telephone, message in messages),
+                                       return_exceptions=True)
+        return [result if isinstance(result, BaseException) else None for result in results]
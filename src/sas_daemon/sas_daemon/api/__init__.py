@@ -13,5 +13,9 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 '''
-from .BasicAPI import BasicAPI
-from .Telnyx import TelnyxAPI
\ No newline at end of file
+from .BasicAPI import BasicAPI, GatewayError, RateLimitedError
+from .Telnyx import TelnyxAPI
+from .HTTPGateway import HTTPGatewayAPI
+from .Dispatcher import SMSDispatcher
+from .RateLimiter import RateLimiter
+from .SenderPool import SenderPool
\ No newline at end of file
@@ -0,0 +1,116 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+This file (cache.py) contains the in-process caches that sit in front of the
+database for rows that are read often but rarely change (templates and people).
+'''
+from __future__ import annotations
+from typing import Any, Callable, Generic, Hashable, TypeVar
+from collections import OrderedDict
+from .templates import Template, PersonTemplateArguments
+from .database import Database
+from . import Constants
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    def __init__(self, maxsize:int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items:OrderedDict[K, V] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key:K, loader:Callable[[K], V|None]) -> V|None:
+        """Return the cached value or load (and cache) it, `None` values are not cached."""
+        value = self._items.get(key)
+        if value is not None:
+            self.hits += 1
+            self._items.move_to_end(key)
+            return value
+
+        self.misses += 1
+        value = loader(key)
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def put(self, key:K, value:V):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key:K):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class DatabaseCache:
+    def __init__(self, db:Database,
+                 template_cache_size:int = Constants.TEMPLATE_CACHE_SIZE,
+                 person_cache_size:int = Constants.PERSON_CACHE_SIZE):
+        """Caches templates (parsed) and people in front of a Database.
+
+        The cache doesn't notice changes made to the database directly,
+        whoever writes must invalidate (or put) the changed objects.
+        """
+        self.db = db
+        self.templates:LRUCache[int, Template] = LRUCache(template_cache_size)
+        self.people:LRUCache[int, PersonTemplateArguments] = LRUCache(person_cache_size)
+
+    def get_template(self, id:int) -> Template|None:
+        return self.templates.get(id, self.db.get_template)
+
+    def put_template(self, template:Template):
+        if template.id is not None:
+            self.templates.put(template.id, template)
+
+    def invalidate_template(self, id:int):
+        self.templates.invalidate(id)
+
+    def get_person(self, id:int) -> PersonTemplateArguments|None:
+        return self.people.get(id, self.db.get_person)
+
+    def put_person(self, person:PersonTemplateArguments):
+        if person.id is not None:
+            self.people.put(person.id, person)
+
+    def invalidate_person(self, id:int):
+        self.people.invalidate(id)
+
+    def clear(self):
+        self.templates.clear()
+        self.people.clear()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "templates": self.templates.stats(),
+            "people": self.people.stats()
+        }
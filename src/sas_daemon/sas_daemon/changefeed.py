@@ -0,0 +1,97 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+This file (changefeed.py) contains the feed of changes made to the stored objects,
+clients subscribe to it instead of polling the listings.
+'''
+from __future__ import annotations
+from typing import Any, Iterable
+from . import Constants
+import asyncio
+import logging
+
+logger = logging.getLogger("sas.daemon")
+
+OBJECTS = ("template", "people", "rule")
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+
+class Subscription:
+    def __init__(self, objects:Iterable[str]|None, maxsize:int):
+        """The events a subscriber hasn't received yet.
+
+        Once the subscriber falls `maxsize` events behind it is dropped from the feed
+        and `overflowed` is set, the subscriber should then disconnect.
+
+        Args:
+            objects (Iterable[str] | None): The objects (see OBJECTS) to receive events of, None for all.
+            maxsize (int): Number of events that may wait for the subscriber.
+        """
+        self.objects = frozenset(objects) if objects is not None else None
+        self.queue:asyncio.Queue[dict[str, Any]] = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def wants(self, event:dict[str, Any]) -> bool:
+        return self.objects is None or event["object"] in self.objects
+
+    def push(self, event:dict[str, Any]) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.overflowed = True
+            return False
+
+    async def get(self) -> dict[str, Any]:
+        return await self.queue.get()
+
+
+class ChangeFeed:
+    def __init__(self, queue_size:int = Constants.CHANGEFEED_QUEUE_SIZE):
+        """Delivers change events to every subscriber.
+
+        An event is a dict:
+        {"object": "template"|"people"|"rule", "event": "created"|"updated"|"deleted", "id": ..., "fields": {...}}
+        "fields" holds the changed fields (missing for deletions), people created in bulk are reported
+        with a single event that has "id": null and "id_range": [first, last].
+        """
+        self.queue_size = queue_size
+        self.subscribers:set[Subscription] = set()
+        self.dropped = 0
+
+    def subscribe(self, objects:Iterable[str]|None = None) -> Subscription:
+        subscription = Subscription(objects, self.queue_size)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription:Subscription):
+        self.subscribers.discard(subscription)
+
+    def publish(self, object_name:str, event:str, id:int|None = None, fields:dict[str, Any]|None = None, **extra):
+        if not self.subscribers:
+            return
+
+        message:dict[str, Any] = {"object": object_name, "event": event, "id": id, **extra}
+        if fields is not None:
+            message["fields"] = fields
+
+        for subscription in list(self.subscribers):
+            if subscription.wants(message) and not subscription.push(message):
+                # A slow consumer must not hold an unbounded backlog, drop it instead
+                self.subscribers.discard(subscription)
+                self.dropped += 1
+                logger.warning("Change feed subscriber fell %d events behind, dropping it", self.queue_size)
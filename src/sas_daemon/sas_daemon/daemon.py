@@ -14,13 +14,16 @@ See the License for the specific language governing permissions and
 limitations under the License.
 '''
 from .database import Database
-from .rules import SendMessageRule
+from .cache import DatabaseCache
+from .changefeed import UPDATED
+from .rules import SendMessageRule, RuleScheduler
 from .datetimezone import datetimezone
 from .security import Security, User
 import pytz
 from . import Constants
 from .wsAPI.server import WSAPI
-from .api import TelnyxAPI
+from .api import BasicAPI, TelnyxAPI, HTTPGatewayAPI, SMSDispatcher, SenderPool
+from .outbox import OutboxWorker
 import asyncio
 import logging, sys
 
@@ -31,15 +34,16 @@ logger.addHandler(logging.StreamHandler(sys.stdout))
 
 class Daemon:
     def __init__(self):
-        self.collect_rules_interval = Constants.COLLECT_RULES_INTERVAL
-
         self.db = Database(Constants.DATABASE_FILE)
-        self.security = Security(self.db, Constants.PASSWORD_TIME_COST, Constants.PASSWORD_MEMORY_COST, Constants.PASSWORD_PARALLELISM)
-        self.sms_gateway:TelnyxAPI|None = None
-        self.operations:dict[int, asyncio.Task] = {}
-        self.op_lock = asyncio.Lock()
-
-        self.wsapi = WSAPI(self.db, self.security, Constants.API_ADDRESS, Constants.API_PORT)
+        self.cache = DatabaseCache(self.db, Constants.TEMPLATE_CACHE_SIZE, Constants.PERSON_CACHE_SIZE)
+        self.security = Security(self.db, Constants.PASSWORD_TIME_COST, Constants.PASSWORD_MEMORY_COST, Constants.PASSWORD_PARALLELISM, Constants.PASSWORD_HASH_WORKERS)
+        self.sms_gateway:BasicAPI|None = None
+        self.dispatcher = SMSDispatcher(Constants.SMS_DISPATCH_CONCURRENCY)
+        self.scheduler = RuleScheduler(self.load_rule, self.send_sms, self.update_rule_last_executed)
+        self.outbox = OutboxWorker(self.db, self.dispatcher, lambda: self.sms_gateway)
+        self.outbox_task:asyncio.Task|None = None
+
+        self.wsapi = WSAPI(self.db, self.security, Constants.API_ADDRESS, Constants.API_PORT, self.cache)
         # Update when a rule is updated, their attributes are automatically updated before sending.
         self.wsapi.OPTIONS["rule"]["add"] = self.rule_add_and_register # type: ignore
         self.wsapi.OPTIONS["rule"]["alter"] = self.rule_alter_and_register # type: ignore
@@ -47,47 +51,75 @@ class Daemon:
         self.wsapi.OPTIONS["timezone"]["alter"] = self.update_timezone # type: ignore
         self.wsapi.OPTIONS["sms-api-key"]["alter"] = self.update_apikey # type: ignore
         self.wsapi.OPTIONS["telephone"]["alter"] = self.update_telephone # type: ignore
+        self.wsapi.OPTIONS["telephone"]["add"] = self.add_telephone # type: ignore
+        self.wsapi.OPTIONS["telephone"]["remove"] = self.remove_telephone # type: ignore
+        self.wsapi.stats_sources["scheduler"] = self.scheduler.stats
+        self.wsapi.stats_sources["rate_limiter"] = self.dispatcher.limiter.stats
+        self.wsapi.stats_sources["outbox"] = self.outbox.stats
 
 
+    def reload_gateway(self):
+        """Build the SMS_GATEWAY gateway from the api-key and telephone settings, None if they are missing."""
+        api_key = self.db.get_setting(Constants.DATABASE_APIKEY_SETTING)
+        numbers = SenderPool.parse_numbers(self.db.get_setting(Constants.DATABASE_TELEPHONE_SETTING))
+        gateways:list[BasicAPI] = []
+        if Constants.SMS_GATEWAY == "http":
+            gateways = [HTTPGatewayAPI(Constants.SMS_GATEWAY_URL, api_key, number) for number in numbers]
+        elif api_key:
+            gateways = [TelnyxAPI(api_key, number) for number in numbers]
+        self.sms_gateway = SenderPool(gateways, Constants.SENDER_POOL_POLICY, self.dispatcher.load) if gateways else None
+        self.outbox.notify()
+
     async def update_apikey(self, wsapi:WSAPI, current_user:User, **kwargs):
         try:
-            if kwargs['api-key']:
-                telephone = self.db.get_setting(Constants.DATABASE_TELEPHONE_SETTING)
-                if telephone:
-                    self.sms_gateway = TelnyxAPI(kwargs["api-key"], telephone)
-            else:
-                self.sms_gateway = None
-
             self.db.set_setting(Constants.DATABASE_APIKEY_SETTING, kwargs['api-key'])
+            self.reload_gateway()
             return {"status": "success"}
         except Exception:
             return {}
     
     async def update_telephone(self, wsapi:WSAPI, current_user:User, **kwargs):
         try:
-            if kwargs['telephone']:
-                apikey = self.db.get_setting(Constants.DATABASE_APIKEY_SETTING)
-                if apikey:
-                    self.sms_gateway = TelnyxAPI(apikey, kwargs['telephone'])
-            else:
-                self.sms_gateway = None
+            # A comma separated list of sender numbers
+            numbers = SenderPool.parse_numbers(kwargs['telephone'])
+            self.db.set_setting(Constants.DATABASE_TELEPHONE_SETTING, SenderPool.format_numbers(numbers) or None)
+            self.reload_gateway()
+            return {"status": "success"}
+        except Exception:
+            return {}
+
+    async def add_telephone(self, wsapi:WSAPI, current_user:User, **kwargs):
+        try:
+            numbers = SenderPool.parse_numbers(self.db.get_setting(Constants.DATABASE_TELEPHONE_SETTING))
+            added = SenderPool.parse_numbers(kwargs['telephone'])
+            if not added:
+                raise ValueError("Invalid TELEPHONE parameter")
+            numbers = SenderPool.parse_numbers(SenderPool.format_numbers(numbers + added))
+            self.db.set_setting(Constants.DATABASE_TELEPHONE_SETTING, SenderPool.format_numbers(numbers))
+            self.reload_gateway()
+            return {"status": "success"}
+        except Exception:
+            return {}
+
+    async def remove_telephone(self, wsapi:WSAPI, current_user:User, **kwargs):
+        try:
+            removed = kwargs['telephone'].replace(' ', '')
+            numbers = SenderPool.parse_numbers(self.db.get_setting(Constants.DATABASE_TELEPHONE_SETTING))
+            remaining = [number for number in numbers if number.replace(' ', '') != removed]
+            if len(remaining) == len(numbers):
+                raise ValueError("Telephone not found")
+            self.db.set_setting(Constants.DATABASE_TELEPHONE_SETTING, SenderPool.format_numbers(remaining) or None)
+            self.reload_gateway()
             return {"status": "success"}
         except Exception:
             return {}
 
     async def update_timezone(self, wsapi:WSAPI, current_user:User, **kwargs):
         try:
-            datetimezone.set_tz(pytz.timezone(kwargs["timezone"]))
-            self.db.set_setting("timezone", kwargs["timezone"])
-            async with self.op_lock:
-                all_ids = set(self.operations.keys())
-                for id in all_ids:
-                    self.operations[id].cancel()
-                    rule = self.db.get_rule(id)
-                    if rule is None:
-                        del self.operations[id]
-                    else:
-                        self.operations[id] = asyncio.create_task(rule.infschedule(self.send_sms, self.update_rule_last_executed))
+            tz = pytz.timezone(kwargs["timezone"])
+            self.db.set_setting(Constants.DATABASE_TIMEZONE_SETTING, kwargs["timezone"])
+            # The due times are absolute, only the dates shown through the API change
+            datetimezone.set_tz(tz)
             return {"status": "success"}
         except Exception:
             return {}
@@ -96,80 +128,61 @@ class Daemon:
         res = await wsapi.rule_add(current_user, **kwargs)
         if "added_id" in res:
             id:int = res["added_id"]
-            rule:SendMessageRule = self.db.get_rule(id)
+            rule:SendMessageRule|None = self.db.get_rule(id, with_recipients=False)
             if rule:
-                async with self.op_lock:
-                    self.operations[id] = asyncio.create_task(rule.infschedule(self.send_sms, self.update_rule_last_executed))
+                self.db.on_commit(lambda: self.scheduler.schedule(rule))
         return res
 
     async def rule_alter_and_register(self, wsapi:WSAPI, current_user:User, **kwargs):
         res = await wsapi.rule_alter(current_user, **kwargs)
         if "status" in res and res["status"] == "success":
             id:int = kwargs["id"]
-            rule:SendMessageRule = self.db.get_rule(id)
+            rule:SendMessageRule|None = self.db.get_rule(id, with_recipients=False)
 
-            if rule:
-                async with self.op_lock:
-                    if id in self.operations.keys():
-                        self.operations[id].cancel()
-                    if rule is None:
-                        del self.operations[id]
-                    else:
-                        self.operations[id] = asyncio.create_task(rule.infschedule(self.send_sms, self.update_rule_last_executed))
+            if rule is None:
+                self.db.on_commit(lambda: self.scheduler.remove(id))
+            else:
+                self.db.on_commit(lambda: self.scheduler.schedule(rule))
         return res
     
     async def rule_deregister_and_remove(self, wsapi:WSAPI, current_user:User, **kwargs):
+        res = await wsapi.rule_remove(current_user, **kwargs)
         id = kwargs.get("id", None)
-        if isinstance(id, int):
-            async with self.op_lock:
-                if id in self.operations.keys():
-                    self.operations[id].cancel()
-                    del self.operations[id]
-        return await wsapi.rule_remove(current_user, **kwargs)
+        if "status" in res and res["status"] == "success":
+            self.db.on_commit(lambda: self.scheduler.remove(id))
+        return res
 
     async def send_sms(self, pta:SendMessageRule): # callback
         template = pta.template
         if pta.template.id is not None:
-            temp = self.db.get_template(pta.template.id)
+            temp = self.cache.get_template(pta.template.id)
             if temp is not None:
                 template = temp
 
-        for recipient in pta.recipients:
-            if recipient.id is not None:
-                temp = self.db.get_person(recipient.id)
-                if temp is not None:
-                    recipient = temp
-            msg = template.compileFor(recipient)
-            if self.sms_gateway:
-                self.sms_gateway.sendSMS(recipient.telephone.replace(' ', ''), msg)
-    
+        # Stream the current recipient data straight from the database into the outbox
+        recipients = self.db.iter_recipients(pta.id) if pta.id is not None else iter(pta.recipients)
+        messages = ((recipient.id, recipient.telephone.replace(' ', ''), msg) for recipient, msg in template.compileMany(recipients))
+        queued = self.db.enqueue_execution(pta.id, pta.last_executed or int(datetimezone.now()), messages)
+        logger.info("Rule(label=%s): %d message(s) queued", pta.label, queued)
+        self.outbox.notify()
+
+    def load_rule(self, id:int) -> SendMessageRule|None:
+        # Recipients are streamed by send_sms, no need to load them here
+        return self.db.get_rule(id, with_recipients=False)
+
     async def update_rule_last_executed(self, rule:SendMessageRule):
-        self.db.alter_rule(rule)
-    
-    async def collect_rules_indefinitely(self):
-        while True:
-            async with self.op_lock:
-                keys_to_remove = []
-                for k,v in self.operations.items():
-                    if v.done():
-                        keys_to_remove.append(k)
-                
-                for k in keys_to_remove:
-                    del self.operations[k]
-            await asyncio.sleep(self.collect_rules_interval)
+        # send_sms already saved last_executed together with the queued messages
+        if rule.id is not None and self.db.changes is not None:
+            self.db.changes.publish("rule", UPDATED, rule.id, {"last_executed": rule.str_last_executed})
 
     async def start(self):
-        api_key = self.db.get_setting(Constants.DATABASE_APIKEY_SETTING)
-        telephone = self.db.get_setting(Constants.DATABASE_TELEPHONE_SETTING)
-        if api_key is not None and telephone is not None:
-            self.sms_gateway = TelnyxAPI(api_key, telephone)
+        self.reload_gateway()
 
         timezone = self.db.get_setting(Constants.DATABASE_TIMEZONE_SETTING)
         if timezone:
             datetimezone.set_tz(pytz.timezone(timezone))
-        for rule in self.db.get_rules():
-            if rule.id is not None:
-                self.operations[rule.id] = asyncio.create_task(rule.infschedule(self.send_sms, self.update_rule_last_executed))
+        self.scheduler.catch_up(self.db.get_rules(with_recipients=False))
 
         await self.wsapi.start_server()
-        await self.collect_rules_indefinitely()
\ No newline at end of file
+        self.outbox_task = asyncio.create_task(self.outbox.run())
+        await self.scheduler.run()
\ No newline at end of file
@@ -18,22 +18,205 @@ class Database: pass # type: ignore
 
 from .templates import PersonTemplateArguments, Template
 from .rules import SendMessageRule
-from .datetimezone import datetimezone
 from .security import User
 from . import Constants
-from datetime import datetime, timedelta
+from . import migrations
+from .changefeed import ChangeFeed, CREATED, UPDATED, DELETED
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator
+from pathlib import Path
+from queue import SimpleQueue
+import contextlib
 import sqlite3
-import os, logging
+import asyncio
+import os, json, time, logging
 
 logger = logging.getLogger("sas.daemon")
 
+# `Outbox`.`status`
+OUTBOX_PENDING = 0
+OUTBOX_SENT = 1
+OUTBOX_FAILED = 2
+
+class ReadPool:
+    def __init__(self, dbName:str, size:int = Constants.DATABASE_READERS):
+        """A pool of read-only Database objects used from worker threads.
+
+        Args:
+            dbName (str): The database file.
+            size (int, optional): Number of connections (and threads).
+        """
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sas-db")
+        self._readers:SimpleQueue[Database] = SimpleQueue()
+        for _ in range(size):
+            self._readers.put(Database(dbName, readonly=True))
+
+    def _call(self, fn:Callable[..., Any], args:tuple, kwargs:dict[str, Any]) -> Any:
+        reader = self._readers.get()
+        try:
+            return fn(reader, *args, **kwargs)
+        finally:
+            self._readers.put(reader)
+
+    async def run(self, fn:Callable[..., Any], *args, **kwargs) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, fn, args, kwargs)
+
+
 class Database:
-    def __init__(self, dbName:str):
+    def __init__(self, dbName:str, readonly:bool = False):
+        """SQLite storage of the daemon.
+
+        Args:
+            dbName (str): The database file.
+            readonly (bool, optional): Open a read-only connection that can be used from any (single) thread,
+                                       used by the ReadPool. Defaults to False.
+        """
+        self.readers:ReadPool|None = None
+        self.changes:ChangeFeed|None = None
+        self._transaction_depth = 0
+        self._on_commit:list[Callable[[], None]] = []
+        if readonly:
+            self.conn = sqlite3.connect(Path(dbName).absolute().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+            self.configure()
+            return
+
         initDB = not os.path.exists(dbName)
         self.conn = sqlite3.connect(dbName)
+        self.configure()
+        if Constants.DATABASE_WAL:
+            self.conn.execute("PRAGMA journal_mode=WAL;")
         if initDB:
             self.init_db()
             logger.info("Database(%s) not found, a new database was initialized!", os.path.abspath(dbName))
+        migrations.migrate(self.conn)
+        self.changes = ChangeFeed()
+
+        if Constants.DATABASE_READERS > 0:
+            self.readers = ReadPool(dbName, Constants.DATABASE_READERS)
+
+    def configure(self):
+        self.conn.execute(f"PRAGMA synchronous={Constants.DATABASE_SYNCHRONOUS};")
+        self.conn.execute(f"PRAGMA cache_size={Constants.DATABASE_CACHE_SIZE:d};")
+        self.conn.execute(f"PRAGMA mmap_size={Constants.DATABASE_MMAP_SIZE:d};")
+        self.conn.execute(f"PRAGMA busy_timeout={Constants.DATABASE_BUSY_TIMEOUT:d};")
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[Database]:
+        """Group all the writes of the block in a single transaction.
+
+        The writes within the block don't commit on their own, everything is committed at the end of
+        the outermost block or rolled back if the block raises. Blocks may be nested.
+        NOTE: The connection is shared, don't await anything that may write inside the block.
+        """
+        if self._transaction_depth == 0 and not self.conn.in_transaction:
+            self.conn.execute("BEGIN;")
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.conn.rollback()
+                self._on_commit.clear()
+            raise
+
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self._commit()
+
+    def on_commit(self, callback:Callable[[], None]):
+        """Call `callback` once the current transaction is committed (now if there is none).
+
+        If the transaction is rolled back the callback is dropped.
+        """
+        if self._transaction_depth == 0 and not self.conn.in_transaction:
+            callback()
+        else:
+            self._on_commit.append(callback)
+
+    def _commit(self):
+        if self._transaction_depth == 0:
+            self.conn.commit()
+            callbacks, self._on_commit = self._on_commit, []
+            for callback in callbacks:
+                callback()
+
+    def _rollback(self):
+        # Inside a transaction() the error reaches the block, which rolls back everything
+        if self._transaction_depth == 0:
+            self.conn.rollback()
+            self._on_commit.clear()
+
+    def _publish(self, object_name:str, event:str, id:int|None = None, fields:dict[str, Any]|None = None, **extra):
+        """Report a change to the subscribers of the change feed once it is committed."""
+        changes = self.changes
+        if changes is not None and changes.subscribers:
+            self.on_commit(lambda: changes.publish(object_name, event, id, fields, **extra))
+
+    async def read(self, fn:Callable[..., Any], *args, **kwargs) -> Any:
+        """Run `fn(db, *args, **kwargs)` on a read-only connection in a worker thread.
+
+        Falls back to this connection (and the current thread) when there is no ReadPool.
+
+        Example:
+            people = await db.read(Database.get_people, limit, offset)
+        """
+        if self.readers is None:
+            return fn(self, *args, **kwargs)
+        return await self.readers.run(fn, *args, **kwargs)
+
+    @staticmethod
+    def _prefix_filter(column:str, prefix:str|None) -> tuple[str, tuple]|None:
+        # A range instead of LIKE, so the index of the column can be used
+        if not prefix:
+            return None
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return f"({column} >= ? AND {column} < ?)", (prefix, upper)
+
+    @staticmethod
+    def _listing_query(columns:str, source:str, id_column:str, sort_column:str|None, filters:list[tuple[str, tuple]|None],
+                       limit:int|None, offset:int|None, after_id:int|None, after:str|None) -> tuple[str, tuple]:
+        """Build a listing query: `SELECT columns FROM source` filtered, sorted and paged.
+
+        Rows are ordered by (sort_column, id_column). A page starts after the row (after, after_id),
+        that is a keyset cursor: its cost doesn't depend on how deep the page is, unlike OFFSET.
+        `after` is the sort_column value of that row (None when sorting by id or the value was NULL).
+        """
+        conditions:list[str] = []
+        params:list = []
+        for f in filters:
+            if f is not None:
+                conditions.append(f[0])
+                params.extend(f[1])
+
+        def where(extra:list[str]) -> str:
+            return (" WHERE " + " AND ".join(conditions + extra)) if conditions or extra else ""
+
+        if sort_column is None:
+            extra = [f"{id_column} > ?"] if after_id is not None else []
+            query = f"SELECT {columns} FROM {source}{where(extra)} ORDER BY {id_column}"
+            if after_id is not None:
+                params.append(after_id)
+        elif after_id is not None and after is None:
+            # NULLs sort first, the page is the rest of the NULLs followed by everything else.
+            # A single OR condition can't walk the index, the two halves are merged instead.
+            query = (f"SELECT * FROM (SELECT {columns}, {sort_column} AS `_sort`, {id_column} AS `_id` FROM {source}{where([f'{sort_column} IS NULL', f'{id_column} > ?'])}"
+                     f" UNION ALL SELECT {columns}, {sort_column}, {id_column} FROM {source}{where([f'{sort_column} IS NOT NULL'])})"
+                     f" ORDER BY `_sort`, `_id`")
+            params = params + [after_id] + params
+        else:
+            extra = [f"({sort_column}, {id_column}) > (?, ?)"] if after_id is not None else []
+            query = f"SELECT {columns} FROM {source}{where(extra)} ORDER BY {sort_column}, {id_column}"
+            if after_id is not None:
+                params.extend((after, after_id))
+
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+            if offset is not None:
+                query += " OFFSET ?"
+                params.append(offset)
+        return query, tuple(params)
     
 
     def init_db(self):
@@ -134,15 +317,35 @@ class Database:
         if row:
             return PersonTemplateArguments(id=id, first_name=row[0], last_name=row[1], telephone=row[2], address=row[3])
 
-    def get_people(self, limit:int|None = None, offset:int|None = None) -> list[PersonTemplateArguments]:
-        query:str = 'SELECT `id`, `first_name`, `last_name`, `telephone`, `address` FROM `People`'
-        params:tuple = tuple()
-        if limit is not None:
-            query += ' LIMIT ?'
-            params = (limit,)
-            if offset is not None:
-                query += ' OFFSET ?'
-                params = (limit, offset)
+    PEOPLE_SORT_COLUMNS = {"id": None, "first_name": "`first_name`", "last_name": "`last_name`", "telephone": "`telephone`"}
+
+    def get_people(self, limit:int|None = None, offset:int|None = None,
+                   after_id:int|None = None, after:str|None = None, sort:str = "id",
+                   name_prefix:str|None = None, telephone_prefix:str|None = None) -> list[PersonTemplateArguments]:
+        """Fetch a page of people.
+
+        Args:
+            limit (int | None, optional): Maximum number of people to return.
+            offset (int | None, optional): Number of people to skip (prefer `after_id`).
+            after_id (int | None, optional): Return the people after this one (keyset pagination).
+            after (str | None, optional): The `sort` value of the `after_id` person.
+            sort (str, optional): One of PEOPLE_SORT_COLUMNS. Defaults to "id".
+            name_prefix (str | None, optional): Only people whose first or last name starts with this.
+            telephone_prefix (str | None, optional): Only people whose telephone starts with this.
+        """
+        if sort not in self.PEOPLE_SORT_COLUMNS:
+            raise ValueError(f"Can't sort people by {sort}")
+
+        name_filter = None
+        first_name = self._prefix_filter("`first_name`", name_prefix)
+        last_name = self._prefix_filter("`last_name`", name_prefix)
+        if first_name is not None and last_name is not None:
+            name_filter = (f"({first_name[0]} OR {last_name[0]})", first_name[1] + last_name[1])
+
+        query, params = self._listing_query("`id`, `first_name`, `last_name`, `telephone`, `address`", "`People`",
+                                            "`id`", self.PEOPLE_SORT_COLUMNS[sort],
+                                            [name_filter, self._prefix_filter("`telephone`", telephone_prefix)],
+                                            limit, offset, after_id, after)
         cur = self.conn.execute(query, params)
 
         res:list[tuple[int, str, str, str, str]] = cur.fetchall()
@@ -161,21 +364,42 @@ class Database:
             return list(map(lambda x: PersonTemplateArguments(id=x[0], first_name=x[1], last_name=x[2], telephone=x[3], address=x[4]), res))
         return []
     
+    def iter_recipients(self, ruleId:int, chunk_size:int = Constants.DATABASE_FETCH_CHUNK_SIZE) -> Iterator[PersonTemplateArguments]:
+        """Stream the recipients of a rule without loading all of them in memory.
+
+        Args:
+            ruleId (int): The rule to fetch the recipients of.
+            chunk_size (int, optional): Number of rows fetched from the cursor at a time.
+
+        Yields:
+            PersonTemplateArguments: The current data of each recipient.
+        """
+        cur = self.conn.execute("SELECT `P`.`id`, `P`.`first_name`, `P`.`last_name`, `P`.`telephone`, `P`.`address` FROM `PeopleInRule` as `PIR` JOIN `People` AS `P` ON `PIR`.`personID` = `P`.`id` WHERE `PIR`.`ruleID`=?;", (ruleId,))
+        try:
+            while True:
+                rows:list[tuple[int, str|None, str|None, str, str|None]] = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for x in rows:
+                    yield PersonTemplateArguments(id=x[0], first_name=x[1], last_name=x[2], telephone=x[3], address=x[4])
+        finally:
+            cur.close()
+    
     def link_recipient(self, personId:int, ruleId:int):
         self.conn.execute("INSERT INTO `PeopleInRule` (`personID`, `ruleID`) VALUES (?, ?);", (personId, ruleId))
-        self.conn.commit()
+        self._commit()
     
     def unlink_recipient(self, personId:int, ruleId:int):
         self.conn.execute("DELETE FROM `PeopleInRule` WHERE `personID`=? AND `ruleID`=?;", (personId, ruleId))
-        self.conn.commit()
+        self._commit()
     
     def unlink_recipient_from_all_rules(self, personId:int):
         self.conn.execute("DELETE FROM `PeopleInRule` WHERE `personID`=?;", (personId,))
-        self.conn.commit()
+        self._commit()
     
     def unlink_all_recipients_from_rule(self, ruleId:int):
         self.conn.execute("DELETE FROM `PeopleInRule` WHERE `ruleID`=?;", (ruleId,))
-        self.conn.commit()
+        self._commit()
     
     def add_person(self, person:PersonTemplateArguments) -> int|None:
         telephone:str = person.telephone
@@ -183,13 +407,39 @@ class Database:
         last_name:str|None = getattr(person, "last_name", None)
         address:str|None = getattr(person, "address", None)
 
-        self.conn.execute("INSERT INTO `People` (first_name, last_name, telephone, address) VALUES (?, ?, ?, ?);", (first_name, last_name, telephone, address))
+        cur = self.conn.execute("INSERT INTO `People` (first_name, last_name, telephone, address) VALUES (?, ?, ?, ?);", (first_name, last_name, telephone, address))
+        self._publish("people", CREATED, cur.lastrowid, {"first_name": first_name, "last_name": last_name, "telephone": telephone, "address": address})
+        self._commit()
+        return cur.lastrowid
+    
+    def add_people(self, people:list[PersonTemplateArguments]) -> tuple[int, int]|None:
+        """Insert many people in a single transaction.
+
+        Args:
+            people (list[PersonTemplateArguments]): The people to insert, their IDs are ignored.
+
+        Returns:
+            tuple[int, int] | None: The (first, last) ID given to the inserted people, IDs are
+            assigned in the same order as `people`.
+        """
+        id_range = self._insert_people(people)
+        self._commit()
+        return id_range
+
+    def _insert_people(self, people:list[PersonTemplateArguments]) -> tuple[int, int]|None:
+        # NOTE: Doesn't commit, the caller must do that
+        if not people:
+            return None
+
+        self.conn.executemany("INSERT INTO `People` (first_name, last_name, telephone, address) VALUES (?, ?, ?, ?);",
+                              ((getattr(p, "first_name", None), getattr(p, "last_name", None), p.telephone, getattr(p, "address", None)) for p in people))
         cur = self.conn.execute("SELECT last_insert_rowid();")
         res = cur.fetchone()
-        self.conn.commit()
 
-        if res is not None:
-            return res[0]
+        # Rows inserted within one transaction get consecutive row IDs
+        id_range = (res[0] - len(people) + 1, res[0])
+        self._publish("people", CREATED, id_range=list(id_range))
+        return id_range
     
     def ensure_person(self, person:PersonTemplateArguments) -> int|None:
         exists = True
@@ -204,7 +454,8 @@ class Database:
             return self.add_person(person)
         return id
     
-    def alter_person(self, person:PersonTemplateArguments, id:int|None = None):
+    def alter_person(self, person:PersonTemplateArguments, id:int|None = None) -> int:
+        """Update a person, returns the number of rows that changed (0 if there is no such person)."""
         if id is None:
             id = getattr(person, "id", None)
         if id is None:
@@ -214,13 +465,17 @@ class Database:
         last_name:str|None = getattr(person, "last_name", None)
         address:str|None = getattr(person, "address", None)
 
-        self.conn.execute("UPDATE `People` SET `first_name`=?, `last_name`=?, `telephone`=?, `address`=? WHERE `id`=?", (first_name, last_name, telephone, address, id))
-        self.conn.commit()
+        cur = self.conn.execute("UPDATE `People` SET `first_name`=?, `last_name`=?, `telephone`=?, `address`=? WHERE `id`=?", (first_name, last_name, telephone, address, id))
+        if cur.rowcount:
+            self._publish("people", UPDATED, id, {"first_name": first_name, "last_name": last_name, "telephone": telephone, "address": address})
+        self._commit()
+        return cur.rowcount
     
     def delete_person(self, id:int):
         self.unlink_recipient_from_all_rules(id)
         self.conn.execute("DELETE FROM `People` WHERE `id`=?;", (id,))
-        self.conn.commit()
+        self._publish("people", DELETED, id)
+        self._commit()
     
     def get_template(self, id:int) -> Template|None:
         cur = self.conn.execute("SELECT `label`, `message` FROM `Templates` WHERE `id`=?;", (id,))
@@ -228,15 +483,19 @@ class Database:
         if res:
             return Template(id=id, label=res[0], message=res[1])
     
-    def get_templates(self, limit:int|None = None, offset:int|None = None) -> list[Template]:
-        query:str = 'SELECT `id`, `label`, `message` FROM `Templates`'
-        params:tuple = tuple()
-        if limit is not None:
-            query += " LIMIT ?"
-            params = (limit,)
-            if offset is not None:
-                query += " OFFSET ?"
-                params = (limit, offset)
+    TEMPLATE_SORT_COLUMNS = {"id": None, "label": "`label`"}
+
+    def get_templates(self, limit:int|None = None, offset:int|None = None,
+                      after_id:int|None = None, after:str|None = None, sort:str = "id",
+                      label_prefix:str|None = None) -> list[Template]:
+        """Fetch a page of templates, see `get_people` for the pagination parameters."""
+        if sort not in self.TEMPLATE_SORT_COLUMNS:
+            raise ValueError(f"Can't sort templates by {sort}")
+
+        query, params = self._listing_query("`id`, `label`, `message`", "`Templates`",
+                                            "`id`", self.TEMPLATE_SORT_COLUMNS[sort],
+                                            [self._prefix_filter("`label`", label_prefix)],
+                                            limit, offset, after_id, after)
         cur = self.conn.execute(query, params)
         res:list[tuple[int|None, str|None, str]] = cur.fetchall()
         return list(map(lambda x: Template(id=x[0], label=x[1], message=x[2]), res))
@@ -247,7 +506,9 @@ class Database:
         self.conn.execute("INSERT INTO `Templates` (`label`, `message`) VALUES (?, ?)", (label, message))
         cur = self.conn.execute("SELECT last_insert_rowid();")
         res = cur.fetchone()
-        self.conn.commit()
+        if res is not None:
+            self._publish("template", CREATED, res[0], {"label": label, "message": message})
+        self._commit()
 
         if res is not None:
             return res[0]
@@ -265,7 +526,8 @@ class Database:
             return self.add_template(template)
         return id
     
-    def alter_template(self, template:Template, id:int|None = None):
+    def alter_template(self, template:Template, id:int|None = None) -> int:
+        """Update a template, returns the number of rows that changed (0 if there is no such template)."""
         if id is None:
             id = template.id
         if id is None:
@@ -273,71 +535,150 @@ class Database:
 
         label = template.label        
         message = template._message
-        self.conn.execute("UPDATE `Templates` SET `label`=?, `message`=? WHERE `id`=?;", (label, message, id))
-        self.conn.commit()
+        cur = self.conn.execute("UPDATE `Templates` SET `label`=?, `message`=? WHERE `id`=?;", (label, message, id))
+        if cur.rowcount:
+            self._publish("template", UPDATED, id, {"label": label, "message": message})
+        self._commit()
+        return cur.rowcount
     
     def delete_template(self, id:int):
         self.conn.execute("DELETE FROM `Templates` WHERE `id`=?;", (id,))
-        self.conn.commit()
+        self._publish("template", DELETED, id)
+        self._commit()
     
-    def get_rule(self, id:int) -> SendMessageRule|None:
-        cur = self.conn.execute("SELECT T.`id`, T.`message`, SMR.`start_date`, SMR.`end_date`, SMR.`interval`, SMR.`last_executed`, SMR.`label` FROM `SendMessageRule` AS SMR JOIN `Templates` AS T ON SMR.templateID = T.id WHERE SMR.id=?;", (id,))
-        res:tuple[int, str, str, str|None, int|None, str|None, str|None]|None = cur.fetchone()
-        if res:
+    _RULE_COLUMNS = "SMR.`id`, SMR.`label`, T.`id`, T.`message`, SMR.`start_date`, SMR.`end_date`, SMR.`interval`, SMR.`last_executed`"
+    _RECIPIENT_COLUMNS = "`PIR`.`ruleID`, `P`.`id`, `P`.`first_name`, `P`.`last_name`, `P`.`telephone`, `P`.`address`"
+
+    def _build_rules(self, rows:list[tuple[int, str|None, int, str, int, int|None, int|None, int|None]],
+                     recipient_rows:list[tuple[int, int, str|None, str|None, str, str|None]]) -> list[SendMessageRule]:
+        """Build SendMessageRule objects out of rule rows and (ruleID, person...) rows."""
+        # People that are recipients of several rules share the same object
+        people:dict[int, PersonTemplateArguments] = {}
+        recipients:dict[int, list[PersonTemplateArguments]] = {}
+        for x in recipient_rows:
+            person = people.get(x[1])
+            if person is None:
+                person = people[x[1]] = PersonTemplateArguments(id=x[1], first_name=x[2], last_name=x[3], telephone=x[4], address=x[5])
+            recipients.setdefault(x[0], []).append(person)
+
+        # Parse every template once, no matter how many rules use it
+        templates:dict[int, Template] = {}
+        results:list[SendMessageRule] = []
+        for x in rows:
+            # Dates migration 3 couldn't convert are still strings
+            if not all(isinstance(value, int) or value is None for value in (x[4], x[5], x[7])):
+                logger.warning("SendMessageRule(id=%s): Invalid dates, the rule is skipped", x[0])
+                continue
             try:
-                return SendMessageRule(
-                    self.get_recipients(id),
-                    Template(id=res[0], message=res[1]),
-                    datetimezone(datetime.strptime(res[2], Constants.DATETIME_FORMAT)),
-                    datetimezone(datetime.strptime(res[3], Constants.DATETIME_FORMAT)) if res[3] else None,
-                    timedelta(seconds=res[4] if res[4] else 0),
-                    datetimezone(datetime.strptime(res[5], Constants.DATETIME_FORMAT)) if res[5] else None,
-                    id=id,
-                    label=res[6]
-                )
+                template = templates.get(x[2])
+                if template is None:
+                    template = templates[x[2]] = Template(id=x[2], message=x[3])
+
+                results.append(SendMessageRule(
+                    id=x[0],
+                    label=x[1],
+                    recipients=recipients.get(x[0], []),
+                    template=template,
+                    start_date=x[4],
+                    end_date=x[5],
+                    interval=int(x[6]) if x[6] else 0,
+                    last_executed=x[7]
+                ))
             except ValueError:
-                return None
+                pass # ignore
+        return results
+
+    def get_rule(self, id:int, with_recipients:bool = True) -> SendMessageRule|None:
+        cur = self.conn.execute(f"SELECT {self._RULE_COLUMNS} FROM `SendMessageRule` AS SMR JOIN `Templates` AS T ON SMR.templateID = T.id WHERE SMR.id=?;", (id,))
+        rows = cur.fetchall()
+        if not rows:
+            return None
+
+        recipient_rows = []
+        if with_recipients:
+            cur = self.conn.execute(f"SELECT {self._RECIPIENT_COLUMNS} FROM `PeopleInRule` AS `PIR` JOIN `People` AS `P` ON `PIR`.`personID` = `P`.`id` WHERE `PIR`.`ruleID`=?;", (id,))
+            recipient_rows = cur.fetchall()
+        rules = self._build_rules(rows, recipient_rows)
+        return rules[0] if rules else None
+    
+    RULE_SORT_COLUMNS = {"id": None, "label": "SMR.`label`"}
+
+    def get_rules(self, limit:int|None = None, offset:int|None = None,
+                  after_id:int|None = None, after:str|None = None, sort:str = "id",
+                  label_prefix:str|None = None, with_recipients:bool = True) -> list[SendMessageRule]:
+        """Fetch rules along with their templates and recipients in two queries.
+
+        See `get_people` for the pagination parameters. With `with_recipients=False` the recipient
+        lists are left empty and only the first query runs.
+        """
+        if sort not in self.RULE_SORT_COLUMNS:
+            raise ValueError(f"Can't sort rules by {sort}")
+
+        def listing(columns:str) -> tuple[str, tuple]:
+            return self._listing_query(columns, "`SendMessageRule` AS SMR JOIN `Templates` AS T ON SMR.templateID = T.id",
+                                       "SMR.`id`", self.RULE_SORT_COLUMNS[sort],
+                                       [self._prefix_filter("SMR.`label`", label_prefix)],
+                                       limit, offset, after_id, after)
+
+        query, params = listing(self._RULE_COLUMNS)
+        cur = self.conn.execute(query + ";", params)
+        rows = cur.fetchall()
+        if not rows:
+            return []
+        if not with_recipients:
+            return self._build_rules(rows, [])
+
+        recipient_query = f"SELECT {self._RECIPIENT_COLUMNS} FROM `PeopleInRule` AS `PIR` JOIN `People` AS `P` ON `PIR`.`personID` = `P`.`id`"
+        if params:
+            # Restrict the recipients to the same page of rules
+            query, params = listing("SMR.`id` AS `rule_id`")
+            recipient_query += f" WHERE `PIR`.`ruleID` IN (SELECT `rule_id` FROM ({query}))"
+        cur = self.conn.execute(recipient_query + ";", params)
+        return self._build_rules(rows, cur.fetchall())
     
-    def get_rules(self, limit:int|None = None, offset:int|None = None) -> list[SendMessageRule]:
-        query:str = "SELECT SMR.`id`, SMR.`label`, T.`id`, T.`message`, SMR.`start_date`, SMR.`end_date`, SMR.`interval`, SMR.`last_executed` FROM `SendMessageRule` AS SMR JOIN `Templates` AS T ON SMR.templateID = T.id"
-        params:tuple = tuple()
-        results = []
+    def _sync_recipients(self, ruleId:int, recipients:list[PersonTemplateArguments]):
+        """Make `recipients` the exact recipient list of a rule.
+
+        People that don't exist are added to the database (and their ID is set),
+        then only the difference to the current links is inserted/deleted.
+        NOTE: Doesn't commit, the caller must do that.
+        """
+        # Find out which of the given IDs actually exist
+        ids = [r.id for r in recipients if getattr(r, "id", None) is not None]
+        existing_people:set[int] = set()
+        if ids:
+            cur = self.conn.execute("SELECT `id` FROM `People` WHERE `id` IN (SELECT `value` FROM json_each(?));", (json.dumps(ids),))
+            existing_people = {x[0] for x in cur}
+
+        # Add the missing people
+        missing = [r for r in recipients if getattr(r, "id", None) not in existing_people]
+        id_range = self._insert_people(missing)
+        if id_range is not None:
+            for recipient, rid in zip(missing, range(id_range[0], id_range[1] + 1)):
+                recipient.id = rid
 
-        if limit is not None:
-            query += " LIMIT ?"
-            params = (limit,)
-            if offset is not None:
-                query += " OFFSET ?"
-                params = (limit, offset)
+        # Apply the difference to the links
+        wanted = {r.id for r in recipients}
+        cur = self.conn.execute("SELECT `personID` FROM `PeopleInRule` WHERE `ruleID`=?;", (ruleId,))
+        linked = {x[0] for x in cur}
+
+        self.conn.executemany("DELETE FROM `PeopleInRule` WHERE `personID`=? AND `ruleID`=?;", ((pid, ruleId) for pid in linked - wanted))
+        self.conn.executemany("INSERT INTO `PeopleInRule` (`personID`, `ruleID`) VALUES (?, ?);", ((pid, ruleId) for pid in wanted - linked))
+
+    @staticmethod
+    def _rule_fields(rule:SendMessageRule) -> dict[str, Any]:
+        fields = rule.toJSON()
+        del fields["id"]
+        return fields
 
-        cur = self.conn.execute(query, params)
-        res:list[tuple[int, str, int, str, str, str|None, int|None, str|None]] = cur.fetchall()
-        if res:
-            for x in res:
-                try:
-                    smr = SendMessageRule(
-                        id=x[0],
-                        label=x[1],
-                        recipients=self.get_recipients(x[0]),
-                        template=Template(id=x[2], message=x[3]),
-                        start_date=datetimezone(datetime.strptime(x[4], Constants.DATETIME_FORMAT)),
-                       end_date=datetimezone(datetime.strptime(x[5], Constants.DATETIME_FORMAT)) if x[5] else None,
-                        interval=timedelta(seconds=x[6] if x[6] else 0),
-                        last_executed=datetimezone(datetime.strptime(x[7], Constants.DATETIME_FORMAT)) if x[7] else None
-                    )
-                    results.append(smr)
-                except ValueError:
-                    pass # ignore
-        return results
-    
     def add_rule(self, rule:SendMessageRule) -> int|None:
         recipients = rule.recipients
         template = rule.template
         label = rule.label
-        start_date = rule.str_start_date
-        end_date = rule.str_end_date
-        interval = rule._interval
-        last_executed = rule.str_last_executed
+        start_date = rule.start_date
+        end_date = rule.end_date
+        interval = rule.interval
+        last_executed = rule.last_executed
 
 
         # If the template doesn't exist add it to the database
@@ -345,27 +686,26 @@ class Database:
         if template.id is None:
             raise sqlite3.Error("Template existence could not be verified.")
 
-        # Insert all info to the database
-        self.conn.execute('INSERT INTO `SendMessageRule` (`templateID`, `label`, `start_date`, `end_date`, `interval`, `last_executed`) VALUES (?, ?, ?, ?, ?, ?)',
-                          (template.id, label, start_date, end_date, interval.total_seconds(), last_executed))
-        cur = self.conn.execute("SELECT last_insert_rowid();")
-        res = cur.fetchone()
-        if res is None:
-            raise sqlite3.Error("Rule existence could not be verified.")
-        rule.id:int = res[0] # type: ignore
-
-        # Add all people that don't exist to the database
-        # Mark all people in the recipients list as recipients of the rule
-        for recipient in recipients:
-            rid = self.ensure_person(recipient)
-            if rid:
-                recipient.id = rid
-                self.link_recipient(recipient.id, rule.id)
-
-        self.conn.commit()
+        try:
+            # Insert all info to the database
+            cur = self.conn.execute('INSERT INTO `SendMessageRule` (`templateID`, `label`, `start_date`, `end_date`, `interval`, `last_executed`) VALUES (?, ?, ?, ?, ?, ?)',
+                                    (template.id, label, start_date, end_date, interval, last_executed))
+            if cur.lastrowid is None:
+                raise sqlite3.Error("Rule existence could not be verified.")
+            rule.id = cur.lastrowid
+
+            # Add all people that don't exist to the database
+            # Mark all people in the recipients list as recipients of the rule
+            self._sync_recipients(rule.id, recipients)
+            self._publish("rule", CREATED, rule.id, self._rule_fields(rule))
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
         return rule.id
     
-    def alter_rule(self, rule:SendMessageRule, id:int|None = None):
+    def alter_rule(self, rule:SendMessageRule, id:int|None = None) -> int:
+        """Update a rule and its recipients, returns the number of rows that changed (0 if there is no such rule)."""
         if id is None:
             id = rule.id
         if id is None:
@@ -373,32 +713,108 @@ class Database:
         recipients = rule.recipients
         label = rule.label
         template = rule.template
-        start_date = rule.str_start_date
-        end_date = rule.str_end_date
-        interval = rule._interval
-        last_executed = rule.str_last_executed
+        start_date = rule.start_date
+        end_date = rule.end_date
+        interval = rule.interval
+        last_executed = rule.last_executed
 
         # ensure template exists
         template.id = self.ensure_template(template)
 
-        # Clear recipients
-        self.unlink_all_recipients_from_rule(id)
-
-        # Update rule
-        self.conn.execute("UPDATE `SendMessageRule` SET `templateID`=?, `label`=?, `start_date`=?, `end_date`=?, `interval`=?, `last_executed`=? WHERE `id`=?;",
-                          (template.id, label, start_date, end_date, interval.total_seconds(), last_executed, id))
-
-        # Link all new recipients
-        for recipient in recipients:
-            rid = self.ensure_person(recipient)
-            if rid:
-                recipient.id = rid
-                self.link_recipient(recipient.id, id)
+        try:
+            # Update rule
+            cur = self.conn.execute("UPDATE `SendMessageRule` SET `templateID`=?, `label`=?, `start_date`=?, `end_date`=?, `interval`=?, `last_executed`=? WHERE `id`=?;",
+                                    (template.id, label, start_date, end_date, interval, last_executed, id))
+
+            if cur.rowcount:
+                # Only link/unlink the recipients that changed
+                self._sync_recipients(id, recipients)
+                self._publish("rule", UPDATED, id, self._rule_fields(rule))
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
+        return cur.rowcount
     
+    def enqueue_execution(self, ruleId:int|None, last_executed:int, messages:Iterable[tuple[int|None, str, str]]) -> int:
+        """Queue the rendered messages of a rule execution and save its `last_executed`, in one transaction.
+
+        Each message gets the idempotency key "rule id:last_executed:person id", queueing the same
+        execution again doesn't add any messages. SendMessageRule.report_executed keeps last_executed
+        strictly increasing, so every execution of a rule has its own keys.
+
+        last_executed is a single row UPDATE in the transaction of the messages, it isn't deferred and
+        coalesced with the checkpoints of other rules: if the two were committed apart, a crash in between
+        would lose the execution or, once the rule fires again under a new last_executed, send it twice.
+
+        Args:
+            ruleId (int | None): The executed rule.
+            last_executed (int): UTC epoch seconds of the execution.
+            messages (Iterable[tuple[int | None, str, str]]): (person id, telephone, message), consumed lazily.
+
+        Returns:
+            int: The number of messages queued.
+        """
+        now = int(time.time())
+        rows = ((f"{ruleId}:{last_executed}:{personId if personId is not None else f'#{n}'}", ruleId, telephone, message, now, now)
+                for n, (personId, telephone, message) in enumerate(messages))
+        with self.transaction():
+            cur = self.conn.executemany("INSERT OR IGNORE INTO `Outbox` (`idempotency_key`, `rule_id`, `telephone`, `message`, `next_attempt`, `created`) VALUES (?, ?, ?, ?, ?, ?);", rows)
+            if ruleId is not None:
+                self.conn.execute("UPDATE `SendMessageRule` SET `last_executed`=? WHERE `id`=?;", (last_executed, ruleId))
+        return cur.rowcount
+
+    def get_outbox_due(self, limit:int, now:int) -> list[tuple[int, str, str, str, int]]:
+        """The pending messages whose next attempt is due, oldest first.
+
+        Returns:
+            list[tuple[int, str, str, str, int]]: [(id, idempotency key, telephone, message, attempts)]
+        """
+        cur = self.conn.execute(f"SELECT `id`, `idempotency_key`, `telephone`, `message`, `attempts` FROM `Outbox` WHERE `status`={OUTBOX_PENDING:d} AND `next_attempt`<=? ORDER BY `next_attempt`, `id` LIMIT ?;", (now, limit))
+        return cur.fetchall()
+
+    def get_outbox_next_attempt(self) -> int|None:
+        cur = self.conn.execute(f"SELECT MIN(`next_attempt`) FROM `Outbox` WHERE `status`={OUTBOX_PENDING:d};")
+        return cur.fetchone()[0]
+
+    def set_outbox_results(self, sent:list[int], retry:list[tuple[int, int, str]], failed:list[tuple[int, str]],
+                           postponed:list[tuple[int, int, str]]|None = None):
+        """Record the outcome of sending a batch of outbox messages in one transaction.
+
+        Args:
+            sent (list[int]): IDs of the messages the gateway accepted.
+            retry (list[tuple[int, int, str]]): (ID, next attempt (UTC epoch seconds), error) of the messages to try again.
+            failed (list[tuple[int, str]]): (ID, error) of the messages that won't be tried again.
+            postponed (list[tuple[int, int, str]], optional): Like `retry`, but the attempt isn't counted
+                                                              (the gateway rate limited the sender).
+        """
+        now = int(time.time())
+        with self.transaction():
+            self.conn.executemany(f"UPDATE `Outbox` SET `status`={OUTBOX_SENT:d}, `attempts`=`attempts`+1, `sent`=?, `error`=NULL WHERE `id`=?;",
+                                  ((now, id) for id in sent))
+            self.conn.executemany("UPDATE `Outbox` SET `attempts`=`attempts`+1, `next_attempt`=?, `error`=? WHERE `id`=?;",
+                                  ((next_attempt, error, id) for id, next_attempt, error in retry))
+            self.conn.executemany("UPDATE `Outbox` SET `next_attempt`=?, `error`=? WHERE `id`=?;",
+                                  ((next_attempt, error, id) for id, next_attempt, error in postponed or ()))
+            self.conn.executemany(f"UPDATE `Outbox` SET `status`={OUTBOX_FAILED:d}, `attempts`=`attempts`+1, `error`=? WHERE `id`=?;",
+                                  ((error, id) for id, error in failed))
+
+    def purge_outbox(self, before:int) -> int:
+        """Delete the sent and failed messages created before `before` (UTC epoch seconds)."""
+        cur = self.conn.execute(f"DELETE FROM `Outbox` WHERE `status` IN ({OUTBOX_SENT:d}, {OUTBOX_FAILED:d}) AND `created`<?;", (before,))
+        self._commit()
+        return cur.rowcount
+
+    def count_outbox(self) -> dict[int, int]:
+        """{status: number of messages}"""
+        cur = self.conn.execute("SELECT `status`, COUNT(*) FROM `Outbox` GROUP BY `status`;")
+        return dict(cur.fetchall())
+
     def delete_rule(self, id:int):
         self.unlink_all_recipients_from_rule(id)
         self.conn.execute("DELETE FROM `SendMessageRule` WHERE `id`=?;", (id,))
-        self.conn.commit()
+        self._publish("rule", DELETED, id)
+        self._commit()
     
     def get_user(self, username:str) -> User|None:
         cur = self.conn.execute("SELECT `id`, `password` FROM `Users` WHERE `username`=?;", (username,))
@@ -412,7 +828,7 @@ class Database:
     
     def alter_user(self, user:User):
         self.conn.execute("UPDATE `Users` SET `username`=?, `password`=? WHERE `id`=?", (user.username, user.password, user.id))
-        self.conn.commit()
+        self._commit()
     
     def get_setting(self, key:str) -> str|None:
         cur = self.conn.execute("SELECT `value` FROM `Settings` WHERE `key`=?;", (key,))
@@ -421,4 +837,4 @@ class Database:
     
     def set_setting(self, key:str, value:str):
         self.conn.execute("UPDATE `Settings` SET `value`=? WHERE `key`=?;", (value, key))
-        self.conn.commit()
\ No newline at end of file
+        self._commit()
\ No newline at end of file
@@ -1,37 +1,65 @@
 from __future__ import annotations
-from datetime import datetime
+from datetime import datetime, timedelta
 from . import Constants
-from pytz import timezone
+from pytz import timezone, utc
+import time
 import logging
 
 logger = logging.getLogger("sas.daemon")
 
 class datetimezone():
+    """The display timezone.
+
+    Dates are kept as UTC epoch seconds, they are only converted from/to
+    DATETIME_FORMAT strings in this timezone when they cross the WebSocket API.
+    Rules with intervals of whole days also step in this timezone (see `add_days`).
+    """
     __timezone__ = timezone(Constants.DEFAULT_TIMEZONE)
 
-    def __init__(self, dt:datetime) -> None:
-        self.dt = self.recompile(dt)
-        self.tz = self.__timezone__
+    @staticmethod
+    def now() -> float:
+        return time.time()
 
-    @classmethod
-    def now(cls):
-        return cls(datetime.now(cls.__timezone__))
-    
-    @classmethod
-    def recompile(cls, dt:datetime, tz = None) -> datetime:
-        if tz is None: tz = cls.__timezone__
-        return datetime(
-            dt.year, dt.month, dt.day,
-            dt.hour, dt.minute, dt.second, dt.microsecond,
-            tz, fold=dt.fold)
-    
     @classmethod
     def set_tz(cls, tz):
         logger.info("Timezone changed to %s", tz.zone)
         cls.__timezone__ = tz
 
-    def get(self) -> datetime:
-        if self.tz != self.__timezone__:
-            self.dt = self.recompile(self.dt)
-            self.tz = self.__timezone__
-        return self.dt
\ No newline at end of file
+    @classmethod
+    def to_timestamp(cls, value:str, tz = None) -> int:
+        """Convert a DATETIME_FORMAT string (wall clock time of `tz`) to epoch seconds."""
+        if tz is None: tz = cls.__timezone__
+        try:
+            # fromisoformat is much faster than strptime and accepts DATETIME_FORMAT
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            dt = datetime.strptime(value, Constants.DATETIME_FORMAT)
+        if dt.tzinfo is None:
+            dt = tz.localize(dt)
+        return int(dt.timestamp())
+
+    @classmethod
+    def add_days(cls, timestamp:float, days:int, tz = None) -> int:
+        """`timestamp` plus `days` wall clock days of `tz`, the time of day stays the same across DST changes.
+
+        A time of day that occurs twice (the hour repeated when DST ends) may resolve to either occurrence.
+        """
+        if tz is None: tz = cls.__timezone__
+        result = int(timestamp) + days * 86400
+        if tz is utc:
+            return result
+        # Shift by the change of the UTC offset, localize (slow) is only needed next to a DST change
+        offset = datetime.fromtimestamp(timestamp, tz).utcoffset()
+        shift = int((offset - datetime.fromtimestamp(result, tz).utcoffset()).total_seconds()) # type: ignore
+        if shift == 0:
+            return result
+        if datetime.fromtimestamp(result + shift, tz).utcoffset() == offset - timedelta(seconds=shift):
+            return result + shift
+        wall = datetime.fromtimestamp(timestamp, tz).replace(tzinfo=None) + timedelta(days=days)
+        return int(tz.localize(wall).timestamp())
+
+    @classmethod
+    def from_timestamp(cls, timestamp:float, tz = None) -> str:
+        """Convert epoch seconds to a DATETIME_FORMAT string in `tz`."""
+        if tz is None: tz = cls.__timezone__
+        return datetime.fromtimestamp(timestamp, tz).strftime(Constants.DATETIME_FORMAT)
@@ -0,0 +1,143 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+This file (importer.py) contains the bulk import of people from CSV or NDJSON
+data, it is shared by the WebSocket API and the command line.
+'''
+from __future__ import annotations
+from typing import Any, Iterable, Iterator
+from .templates import PersonTemplateArguments
+from .database import Database
+from . import Constants
+import csv
+import json
+
+PEOPLE_COLUMNS = ("first_name", "last_name", "telephone", "address")
+FORMATS = ("csv", "ndjson")
+
+
+def parse_person_row(row:dict[str, Any]) -> PersonTemplateArguments:
+    telephone = row.get("telephone", None)
+    if not isinstance(telephone, str) or not telephone.strip():
+        raise ValueError("Missing telephone")
+
+    values:dict[str, str|None] = {}
+    for column in PEOPLE_COLUMNS:
+        value = row.get(column, None)
+        if value == "":
+            value = None
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"Invalid {column}")
+        values[column] = value
+    return PersonTemplateArguments(**values) # type: ignore
+
+def iter_people_rows(lines:Iterable[str], format:str = "csv", columns:list[str]|None = None) -> Iterator[tuple[int, PersonTemplateArguments|None, str|None]]:
+    """Parse people out of CSV or NDJSON lines.
+
+    Args:
+        lines (Iterable[str]): The lines of the data (a file object works too).
+        format (str, optional): Either "csv" or "ndjson". Defaults to "csv".
+        columns (list[str] | None, optional): The CSV columns, when not given the first line is the header.
+
+    Yields:
+        tuple[int, PersonTemplateArguments | None, str | None]: (row number, person, error), exactly one of
+        person and error is None.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format: {format}")
+
+    if format == "csv":
+        rows:Iterator[Any] = csv.DictReader(lines, fieldnames=columns)
+    else:
+        rows = (line for line in lines if line.strip())
+
+    for number, row in enumerate(rows, 1):
+        try:
+            if format == "ndjson":
+                row = json.loads(row)
+                if not isinstance(row, dict):
+                    raise ValueError("Row is not an object")
+            yield number, parse_person_row(row), None
+        except ValueError as e:
+            yield number, None, str(e)
+
+
+class PeopleImport:
+    def __init__(self, db:Database, chunk_size:int = Constants.IMPORT_CHUNK_SIZE, max_errors:int = Constants.IMPORT_MAX_ERRORS):
+        """Insert parsed people rows in chunks of `chunk_size`, one transaction per chunk.
+
+        Args:
+            db (Database): The database to insert the people into.
+            chunk_size (int, optional): Number of people inserted per transaction.
+            max_errors (int, optional): Number of rejected rows reported in detail.
+        """
+        self.db = db
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.processed = 0
+        self.imported = 0
+        self.rejected = 0
+        self.errors:list[dict[str, Any]] = []
+        self.id_ranges:list[tuple[int, int]] = []
+
+    def _flush(self, chunk:list[PersonTemplateArguments]):
+        id_range = self.db.add_people(chunk)
+        if id_range is not None:
+            self.imported += len(chunk)
+            # Merge with the previous range when nothing was inserted in between
+            if self.id_ranges and self.id_ranges[-1][1] + 1 == id_range[0]:
+                self.id_ranges[-1] = (self.id_ranges[-1][0], id_range[1])
+            else:
+                self.id_ranges.append(id_range)
+        chunk.clear()
+
+    def run(self, rows:Iterable[tuple[int, PersonTemplateArguments|None, str|None]]) -> Iterator[dict[str, int]]:
+        """Import the rows, yielding the progress after every chunk."""
+        chunk:list[PersonTemplateArguments] = []
+        for number, person, error in rows:
+            self.processed += 1
+            if person is None:
+                self.rejected += 1
+                if len(self.errors) < self.max_errors:
+                    self.errors.append({"row": number, "error": error})
+                continue
+
+            chunk.append(person)
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk)
+                yield self.progress()
+
+        if chunk:
+            self._flush(chunk)
+            yield self.progress()
+
+    def progress(self) -> dict[str, int]:
+        return {
+            "processed": self.processed,
+            "imported": self.imported,
+            "rejected": self.rejected
+        }
+
+    def result(self) -> dict[str, Any]:
+        """The outcome of the import.
+
+        "id_ranges" holds [first, last] ID ranges, the accepted rows were given
+        the IDs of these ranges in order.
+        """
+        return {
+            **self.progress(),
+            "id_ranges": [list(r) for r in self.id_ranges],
+            "errors": self.errors
+        }
@@ -17,9 +17,61 @@ This file (main.py) is the main starting point of the "Daemon" component
 of the project (SAS).
 '''
 from sas_daemon.daemon import Daemon
+from sas_daemon.database import Database
+from sas_daemon.importer import PeopleImport, iter_people_rows, FORMATS
+from sas_daemon.mockgateway import MockGateway
+from sas_daemon import Constants
+import argparse
 import asyncio
+import logging
+import os, sys
 
 
+def start_daemon():
+    asyncio.run(Daemon().start())
 
-asyncio.run(Daemon().start())
-# asyncio.run(db_test())
\ No newline at end of file
+def import_people():
+    parser = argparse.ArgumentParser(description="Import people from a CSV or NDJSON file into the SAS database.")
+    parser.add_argument("file", help="The file to import, use - for stdin")
+    parser.add_argument("-f", "--format", choices=FORMATS, help="The file format, guessed from the extension by default")
+    parser.add_argument("-d", "--database", default=Constants.DATABASE_FILE, help="The database file (default: %(default)s)")
+    parser.add_argument("-c", "--chunk-size", type=int, default=Constants.IMPORT_CHUNK_SIZE, help="People inserted per transaction (default: %(default)s)")
+    args = parser.parse_args()
+
+    format = args.format
+    if format is None:
+        format = "ndjson" if os.path.splitext(args.file)[1].lower() in (".ndjson", ".jsonl") else "csv"
+
+    people_import = PeopleImport(Database(args.database), args.chunk_size)
+    with (open(args.file, newline='', encoding="utf-8") if args.file != '-' else sys.stdin) as f:
+        for progress in people_import.run(iter_people_rows(f, format)):
+            print("Processed: %(processed)d, Imported: %(imported)d, Rejected: %(rejected)d" % progress, file=sys.stderr)
+
+    result = people_import.result()
+    for error in result["errors"]:
+        print("Row %(row)d: %(error)s" % error, file=sys.stderr)
+    for first, last in result["id_ranges"]:
+        print("%d-%d" % (first, last))
+
+def mock_gateway():
+    parser = argparse.ArgumentParser(description="Run a local SMS gateway for load testing, set SMS_GATEWAY to \"http\" to use it. Nothing is sent.")
+    parser.add_argument("--host", default="127.0.0.1", help="The address to listen on (default: %(default)s)")
+    parser.add_argument("-p", "--port", type=int, default=8686, help="The port to listen on (default: %(default)s)")
+    parser.add_argument("-l", "--latency", type=float, default=0.05, help="Seconds every request takes (default: %(default)s)")
+    parser.add_argument("-j", "--jitter", type=float, default=0.0, help="Up to this many seconds are randomly added to the latency (default: %(default)s)")
+    parser.add_argument("-e", "--error-rate", type=float, default=0.0, help="The fraction (0-1) of messages that fail (default: %(default)s)")
+    parser.add_argument("-r", "--rate", type=float, default=0.0, help="Messages per second of each sender, 0 for no limit (default: %(default)s)")
+    parser.add_argument("-b", "--burst", type=int, default=1, help="Messages a sender may send at once (default: %(default)s)")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="Seed of the random failures and jitter")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    gateway = MockGateway(args.host, args.port, args.latency, args.jitter, args.error_rate, args.rate, args.burst, args.seed)
+    try:
+        gateway.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    start_daemon()
\ No newline at end of file
@@ -0,0 +1,117 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+This file (migrations.py) contains the ordered schema migrations of the database.
+The schema version is stored in `PRAGMA user_version`, a database created by
+`Database.init_db` starts at version 0.
+NOTE: Never change or reorder existing migrations, only append new ones.
+'''
+from typing import Callable
+from .datetimezone import datetimezone
+from . import Constants
+import sqlite3
+import pytz
+import logging
+
+logger = logging.getLogger("sas.daemon")
+
+
+def _add_lookup_indexes(conn:sqlite3.Connection):
+    # `PeopleInRule` is keyed (personID, ruleID), lookups by rule need their own index
+    conn.execute("CREATE INDEX IF NOT EXISTS `PeopleInRule_ruleID` ON `PeopleInRule` (`ruleID`, `personID`);")
+    conn.execute("CREATE INDEX IF NOT EXISTS `SendMessageRule_templateID` ON `SendMessageRule` (`templateID`);")
+    conn.execute("CREATE INDEX IF NOT EXISTS `People_telephone` ON `People` (`telephone`);")
+
+
+def _add_listing_indexes(conn:sqlite3.Connection):
+    # Sorting and prefix filtering of the listings, the rowid (id) is part of every index
+    conn.execute("CREATE INDEX IF NOT EXISTS `People_first_name` ON `People` (`first_name`);")
+    conn.execute("CREATE INDEX IF NOT EXISTS `People_last_name` ON `People` (`last_name`);")
+    conn.execute("CREATE INDEX IF NOT EXISTS `Templates_label` ON `Templates` (`label`);")
+    conn.execute("CREATE INDEX IF NOT EXISTS `SendMessageRule_label` ON `SendMessageRule` (`label`);")
+
+
+def _store_dates_as_epoch(conn:sqlite3.Connection):
+    # The rule dates were DATETIME_FORMAT strings, wall clock times of the configured timezone
+    res = conn.execute("SELECT `value` FROM `Settings` WHERE `key`=?;", (Constants.DATABASE_TIMEZONE_SETTING,)).fetchone()
+    tz = pytz.timezone(res[0] if res and res[0] else Constants.DEFAULT_TIMEZONE)
+
+    def convert(id, column, value):
+        if not isinstance(value, str):
+            return value
+        try:
+            return datetimezone.to_timestamp(value, tz)
+        except ValueError:
+            # Left as it is (the rule is skipped when loaded), a single bad row must not stop the daemon
+            logger.warning("SendMessageRule(id=%s): Can't convert %s %r, the rule is skipped until it is fixed", id, column, value)
+            return value
+
+    rows = conn.execute("SELECT `id`, `start_date`, `end_date`, `last_executed` FROM `SendMessageRule`;").fetchall()
+    conn.executemany("UPDATE `SendMessageRule` SET `start_date`=?, `end_date`=?, `last_executed`=? WHERE `id`=?;",
+                     ((convert(x[0], "start_date", x[1]), convert(x[0], "end_date", x[2]), convert(x[0], "last_executed", x[3]), x[0])
+                      for x in rows))
+
+
+def _add_outbox(conn:sqlite3.Connection):
+    # Rendered messages waiting to be sent (status 0), sent (1) or given up on (2)
+    conn.execute('''CREATE TABLE IF NOT EXISTS `Outbox` (
+                 `id` INTEGER NOT NULL UNIQUE,
+                 `idempotency_key` TEXT NOT NULL UNIQUE,
+                 `rule_id` INTEGER,
+                 `telephone` TEXT NOT NULL,
+                 `message` TEXT NOT NULL,
+                 `status` INTEGER NOT NULL DEFAULT 0,
+                 `attempts` INTEGER NOT NULL DEFAULT 0,
+                 `next_attempt` INTEGER NOT NULL,
+                 `created` INTEGER NOT NULL,
+                 `sent` INTEGER,
+                 `error` TEXT,
+                 PRIMARY KEY(`id`));''')
+    conn.execute("CREATE INDEX IF NOT EXISTS `Outbox_status` ON `Outbox` (`status`, `next_attempt`);")
+
+
+MIGRATIONS:list[Callable[[sqlite3.Connection], None]] = [
+    _add_lookup_indexes, # 1
+    _add_listing_indexes, # 2
+    _store_dates_as_epoch, # 3
+    _add_outbox, # 4
+]
+
+
+def schema_version(conn:sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+def migrate(conn:sqlite3.Connection) -> int:
+    """Apply every migration that hasn't been applied yet.
+
+    Each migration runs in its own transaction together with the version bump.
+
+    Returns:
+        int: The schema version after migrating.
+    """
+    version = schema_version(conn)
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        conn.commit()
+        conn.execute("BEGIN;")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number:d};")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Database migrated to schema version %d (%s)", number, migration.__name__)
+        version = number
+    return version
@@ -0,0 +1,154 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+This file (mockgateway.py) contains a local SMS gateway (MockGateway) that speaks the
+protocol of api.HTTPGatewayAPI, it doesn't send anything. It is used to load test the
+daemon offline, with a configurable latency, error rate and per sender rate limit.
+GET /stats returns its counters.
+'''
+from __future__ import annotations
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any
+import threading
+import random
+import math
+import time
+import json
+import logging
+
+logger = logging.getLogger("sas.mockgateway")
+
+
+class MockGateway:
+    def __init__(self, host:str = "127.0.0.1", port:int = 8686, latency:float = 0.05, jitter:float = 0.0,
+                 error_rate:float = 0.0, rate:float = 0.0, burst:int = 1, seed:int|None = None):
+        """A fake gateway.
+
+        Args:
+            host (str, optional): The address to listen on.
+            port (int, optional): The port to listen on, 0 for any free port (see `port`).
+            latency (float, optional): Seconds every request takes.
+            jitter (float, optional): Up to this many seconds are randomly added to the latency.
+            error_rate (float, optional): The fraction (0-1) of messages that fail.
+            rate (float, optional): Messages per second each sender may send, 0 for no limit.
+                                    A request over the limit is answered with 429 and a Retry-After header.
+            burst (int, optional): Messages a sender may send at once after being idle.
+            seed (int | None, optional): Seed of the random failures and jitter.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate = rate
+        self.burst = burst
+        self.random = random.Random(seed)
+        self.counters = {"requests": 0, "messages": 0, "sent": 0, "failed": 0, "rate_limited": 0}
+        self._buckets:dict[str, tuple[float, float]] = {} # {sender: (tokens, updated)}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread:threading.Thread|None = None
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return "http://%s:%d" % (self.server.server_address[0], self.port)
+
+    def _take(self, sender:str, count:int) -> float:
+        """Take `count` tokens of `sender`, return 0 or the seconds until they are available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(sender, (float(self.burst), now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < count:
+            self._buckets[sender] = (tokens, now)
+            return (count - tokens) / self.rate
+        self._buckets[sender] = (tokens - count, now)
+        return 0.0
+
+    def send(self, sender:str, messages:list[dict[str, Any]]) -> tuple[int, dict[str, Any], dict[str, str]]:
+        """Handle a batch of messages, returns (HTTP status, body, headers)."""
+        with self._lock:
+            self.counters["requests"] += 1
+            self.counters["messages"] += len(messages)
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter > 0 else 0)
+            retry_after = self._take(sender, len(messages))
+            if retry_after > 0:
+                self.counters["rate_limited"] += len(messages)
+            else:
+                failures = [self.random.random() < self.error_rate for _ in messages]
+
+        time.sleep(delay)
+        if retry_after > 0:
+            return 429, {"error": "Rate limit exceeded"}, {"Retry-After": str(math.ceil(retry_after))}
+
+        results = [{"status": "failed", "error": "Mock failure"} if failed else {"status": "sent", "id": f"mock-{time.time_ns()}-{n}"}
+                   for n, failed in enumerate(failures)]
+        with self._lock:
+            self.counters["failed"] += sum(failures)
+            self.counters["sent"] += len(failures) - sum(failures)
+        return 200, {"results": results}, {}
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self, status:int, body:dict[str, Any], headers:dict[str, str] = {}):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path != "/stats":
+                    return self.reply(404, {"error": "Not found"})
+                with gateway._lock:
+                    self.reply(200, dict(gateway.counters))
+
+            def do_POST(self):
+                if self.path != "/messages":
+                    return self.reply(404, {"error": "Not found"})
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                    sender = str(request["from"])
+                    messages = list(request["messages"])
+                except (ValueError, KeyError, TypeError):
+                    return self.reply(400, {"error": "Invalid request"})
+                self.reply(*gateway.send(sender, messages))
+
+            def log_message(self, format:str, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.server.serve_forever, name="sas-mockgateway", daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        logger.info("Mock gateway listening on %s", self.url)
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
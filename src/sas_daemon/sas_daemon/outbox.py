@@ -0,0 +1,161 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+This file (outbox.py) contains the worker that sends the messages of the `Outbox` table.
+Rule executions only queue their rendered messages there, so a crash or a failing
+gateway can't lose the messages and the scheduler doesn't wait for the gateway.
+'''
+from __future__ import annotations
+from typing import Callable
+from .database import Database, OUTBOX_PENDING, OUTBOX_SENT, OUTBOX_FAILED
+from .api import BasicAPI, SMSDispatcher, RateLimitedError
+from . import Constants
+import asyncio
+import math
+import time
+import logging
+
+logger = logging.getLogger("sas.daemon.outbox")
+
+
+class OutboxWorker:
+    def __init__(self, db:Database, dispatcher:SMSDispatcher, gateway:Callable[[], BasicAPI|None],
+                 batch_size:int = Constants.OUTBOX_BATCH_SIZE, max_attempts:int = Constants.OUTBOX_MAX_ATTEMPTS,
+                 retry_delay:float = Constants.OUTBOX_RETRY_DELAY, max_retry_delay:float = Constants.OUTBOX_RETRY_MAX_DELAY):
+        """Drains the outbox in batches through `dispatcher`.
+
+        A message that fails is tried again after `retry_delay` seconds, doubled after every
+        failed attempt up to `max_retry_delay`, and given up on after `max_attempts` attempts.
+        A message the gateway rate limited (RateLimitedError) is tried again after the delay the
+        gateway asked for (`retry_delay` if it didn't), without counting the attempt.
+        Messages are sent at least once: a message that was sent right before a crash,
+        but wasn't marked as sent, is sent again after the restart.
+
+        Args:
+            db (Database): The database that holds the outbox.
+            dispatcher (SMSDispatcher): Sends the messages.
+            gateway (Callable[[], BasicAPI | None]): Returns the current gateway, nothing is sent while it returns None.
+            batch_size (int, optional): Messages taken from the outbox at a time.
+            max_attempts (int, optional): Attempts before a message is given up on.
+            retry_delay (float, optional): Seconds before the first retry.
+            max_retry_delay (float, optional): Most seconds between retries.
+        """
+        self.db = db
+        self.dispatcher = dispatcher
+        self.gateway = gateway
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.postponed = 0
+        self._wakeup = asyncio.Event()
+        self._purged = 0.0
+
+    def notify(self):
+        """New messages were queued."""
+        self._wakeup.set()
+
+    def backoff(self, attempts:int) -> float:
+        """Seconds to wait after the `attempts`th failed attempt."""
+        return min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+
+    async def drain(self, gateway:BasicAPI) -> int:
+        """Send one batch of due messages and record the results.
+
+        Returns:
+            int: The number of messages taken from the outbox.
+        """
+        rows = self.db.get_outbox_due(self.batch_size, int(time.time()))
+        if not rows:
+            return 0
+
+        results = await self.dispatcher.send_batch(gateway, [(telephone, message) for _, _, telephone, message, _ in rows])
+
+        now = time.time()
+        sent:list[int] = []
+        retry:list[tuple[int, int, str]] = []
+        failed:list[tuple[int, str]] = []
+        postponed:list[tuple[int, int, str]] = []
+        for (id, key, telephone, _, attempts), result in zip(rows, results):
+            if result is None:
+                sent.append(id)
+                continue
+
+            if isinstance(result, RateLimitedError):
+                delay = result.retry_after if result.retry_after is not None else self.retry_delay
+                # Rounded up, a message due within the same second would be taken again right away
+                postponed.append((id, math.ceil(now + delay), str(result)))
+                logger.info("SMS (%s) [%s]: Rate limited, retrying in %.0f s", telephone, key, delay)
+                continue
+
+            attempts += 1
+            if attempts >= self.max_attempts:
+                failed.append((id, str(result)))
+                logger.error("SMS (%s) [%s]: Giving up after %d attempts: %s", telephone, key, attempts, result)
+            else:
+                retry.append((id, int(now + self.backoff(attempts)), str(result)))
+                logger.warning("SMS (%s) [%s]: Attempt %d failed, retrying: %s", telephone, key, attempts, result)
+
+        self.db.set_outbox_results(sent, retry, failed, postponed)
+        self.sent += len(sent)
+        self.retried += len(retry)
+        self.failed += len(failed)
+        self.postponed += len(postponed)
+        return len(rows)
+
+    def purge(self):
+        """Delete the messages older than OUTBOX_RETENTION, at most once per OUTBOX_PURGE_INTERVAL."""
+        now = time.time()
+        if now - self._purged < Constants.OUTBOX_PURGE_INTERVAL:
+            return
+        self._purged = now
+        purged = self.db.purge_outbox(int(now - Constants.OUTBOX_RETENTION))
+        if purged:
+            logger.info("Purged %d message(s) from the outbox", purged)
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = Constants.OUTBOX_POLL_INTERVAL
+            gateway = self.gateway()
+            if gateway is not None:
+                try:
+                    self.purge()
+                    if await self.drain(gateway) == self.batch_size:
+                        continue
+
+                    # Sleep until the next retry is due (or new messages are queued)
+                    next_attempt = self.db.get_outbox_next_attempt()
+                    if next_attempt is not None:
+                        timeout = min(timeout, max(next_attempt - time.time(), 0))
+                except Exception:
+                    logger.error("Failed to drain the outbox", exc_info=True)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        counts = self.db.count_outbox()
+        return {
+            "pending": counts.get(OUTBOX_PENDING, 0),
+            "sent": counts.get(OUTBOX_SENT, 0),
+            "failed": counts.get(OUTBOX_FAILED, 0),
+            "attempts": {"sent": self.sent, "retried": self.retried, "failed": self.failed, "postponed": self.postponed},
+        }
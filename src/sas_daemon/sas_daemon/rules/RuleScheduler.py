@@ -0,0 +1,259 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+This file (RuleScheduler.py) contains a class (RuleScheduler) which keeps the next
+execution time of every SendMessageRule in a single priority queue and fires the rules
+when they are due. Rule data is only loaded at the time a rule fires.
+'''
+from __future__ import annotations
+from typing import Callable, Coroutine, Iterable
+from .SendMessageRule import SendMessageRule
+from ..datetimezone import datetimezone
+from .. import Constants
+import asyncio
+import heapq
+import time
+import logging
+
+logger = logging.getLogger("sas.daemon.rules")
+
+# What happens to the executions a rule missed while the daemon was down
+CATCHUP_ONCE = "once" # Fire the rule once for all of them
+CATCHUP_SKIP = "skip" # Don't fire, wait for the next execution on the rule's schedule
+CATCHUP_ALL = "all" # Fire the rule once for each of them
+CATCHUP_POLICIES = (CATCHUP_ONCE, CATCHUP_SKIP, CATCHUP_ALL)
+
+class RuleScheduler:
+    def __init__(self, loader:Callable[[int], SendMessageRule|None],
+                 callback:Callable[[SendMessageRule], Coroutine],
+                 report_executed_callback:Callable[[SendMessageRule], Coroutine]):
+        """Single timer for all the rules.
+
+        Only (due timestamp, rule id) pairs are kept in memory, the rule itself is
+        fetched through `loader` when it becomes due. Entries are never removed from
+        the heap directly, instead `_due` holds the valid due time of every rule and
+        stale heap entries are skipped when they reach the top.
+
+        Args:
+            loader (Callable[[int], SendMessageRule | None]): Fetches a rule by its ID.
+            callback (Callable[[SendMessageRule], Coroutine]): Called when a rule is due, `last_executed` of the rule
+                                                               already holds this execution. If it raises the execution
+                                                               didn't happen, it is tried again after RULE_RETRY_DELAY.
+            report_executed_callback (Callable[[SendMessageRule], Coroutine]): Called after the rule was executed.
+        """
+        self.loader = loader
+        self.callback = callback
+        self.report_executed_callback = report_executed_callback
+        self._queue:list[tuple[float, int]] = [] # [(due timestamp, rule id)]
+        self._due:dict[int, float] = {} # {rule id: due timestamp}
+        self._firing:dict[int, asyncio.Task] = {}
+        self._tasks:set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+
+        # Overdue firings found by catch_up are spread out by a ramp, `_catch_up` holds
+        # the firings each overdue rule has left (they fire even if the rule isn't due)
+        self._catch_up:dict[int, int] = {} # {rule id: remaining firings}
+        self._ramp_next = 0.0
+        self._ramp_step = 0.0
+        self.catch_up_stats = {"overdue": 0, "deferred": 0, "coalesced": 0, "skipped": 0}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, rule_id:int) -> bool:
+        return rule_id in self._due or rule_id in self._firing
+
+    def schedule(self, rule:SendMessageRule):
+        if rule.id is None:
+            return
+        self._catch_up.pop(rule.id, None)
+
+        ned = rule.next_execution_date
+        if ned is None:
+            self.remove(rule.id)
+            return
+
+        logger.info("Rule(label=%s) scheduled for %s", rule.label, datetimezone.from_timestamp(ned))
+        self.schedule_at(rule.id, ned)
+
+    def schedule_at(self, rule_id:int, due:float):
+        # A firing in progress must not reschedule over the new due time
+        self._firing.pop(rule_id, None)
+
+        self._due[rule_id] = due
+        heapq.heappush(self._queue, (due, rule_id))
+        if self._queue[0] == (due, rule_id):
+            self._wakeup.set()
+
+        # Drop stale entries once they outnumber the valid ones
+        if len(self._queue) > 2 * len(self._due) + 64:
+            self._queue = [(d, i) for i, d in self._due.items()]
+            heapq.heapify(self._queue)
+
+    def remove(self, rule_id:int):
+        self._due.pop(rule_id, None)
+        self._firing.pop(rule_id, None)
+        self._catch_up.pop(rule_id, None)
+
+    def clear(self):
+        self._queue.clear()
+        self._due.clear()
+        self._firing.clear()
+        self._catch_up.clear()
+        self._wakeup.set()
+
+    def catch_up(self, rules:Iterable[SendMessageRule], policy:str = Constants.CATCHUP_POLICY,
+                 rate:float = Constants.CATCHUP_RATE, window:float = Constants.CATCHUP_WINDOW,
+                 max_firings:int = Constants.CATCHUP_MAX_FIRINGS) -> dict[str, int]:
+        """Schedule `rules` on startup, handling the executions they missed while the daemon was down.
+
+        Instead of firing every overdue rule at once they fire oldest first, `rate` firings
+        per second. The rate is raised if needed so that all of them fire within `window` seconds.
+
+        Args:
+            rules (Iterable[SendMessageRule]): Every stored rule.
+            policy (str, optional): One of CATCHUP_POLICIES.
+            rate (float, optional): Overdue firings per second, 0 for no limit.
+            window (float, optional): Seconds to fire all the overdue rules in, 0 for no limit.
+            max_firings (int, optional): Most firings of a single rule with the CATCHUP_ALL policy.
+
+        Returns:
+            dict[str, int]: The counters of catch_up_stats.
+        """
+        if policy not in CATCHUP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy {policy!r}, expected one of {CATCHUP_POLICIES}")
+
+        now = time.time()
+        stats = self.catch_up_stats
+        overdue:list[tuple[float, int, int]] = [] # [(first missed execution, rule id, firings)]
+        for rule in rules:
+            if rule.id is None:
+                continue
+            missed = rule.missed_executions(now)
+            if missed == 0:
+                self.schedule(rule)
+                continue
+
+            stats["overdue"] += 1
+            if policy == CATCHUP_SKIP:
+                stats["skipped"] += missed
+                ned = rule.next_execution_after(now)
+                if ned is not None:
+                    self.schedule_at(rule.id, ned)
+                continue
+
+            if policy == CATCHUP_ALL:
+                firings = min(missed, max_firings)
+                stats["skipped"] += missed - firings
+            else:
+                firings = 1
+                stats["coalesced"] += missed - 1
+            overdue.append((rule.first_missed_execution(now) or now, rule.id, firings))
+
+        overdue.sort()
+        total = sum(firings for _, _, firings in overdue)
+        self._ramp_step = 1 / rate if rate > 0 else 0.0
+        if window > 0 and total * self._ramp_step > window:
+            self._ramp_step = window / total
+        self._ramp_next = now
+        for _, rule_id, firings in overdue:
+            self._catch_up[rule_id] = firings
+            self.schedule_at(rule_id, self._next_slot(now))
+
+        logger.info("Catch-up (%s): %d overdue rule(s), %d firing(s) over %.0fs, %d deferred, %d coalesced, %d skipped",
+                    policy, stats["overdue"], total, total * self._ramp_step,
+                    stats["deferred"], stats["coalesced"], stats["skipped"])
+        return dict(stats)
+
+    def _next_slot(self, now:float) -> float:
+        """The due time of the next catch-up firing."""
+        slot = max(now, self._ramp_next)
+        self._ramp_next = slot + self._ramp_step
+        if slot > now:
+            self.catch_up_stats["deferred"] += 1
+        return slot
+
+    def stats(self) -> dict:
+        return {
+            "scheduled": len(self._due),
+            "firing": len(self._firing),
+            "catch_up": {**self.catch_up_stats, "pending": sum(self._catch_up.values())},
+        }
+
+    def _pop_due(self, now:float) -> float|None:
+        """Start every rule that is due and return the seconds until the next one."""
+        while self._queue:
+            due, rule_id = self._queue[0]
+            if self._due.get(rule_id) != due:
+                heapq.heappop(self._queue)
+                continue
+            if due > now:
+                return due - now
+
+            heapq.heappop(self._queue)
+            del self._due[rule_id]
+            task = asyncio.create_task(self._fire(rule_id))
+            self._firing[rule_id] = task
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return None
+
+    async def _fire(self, rule_id:int):
+        rule = self.loader(rule_id)
+        if rule is None:
+            self._firing.pop(rule_id, None)
+            return
+
+        remaining = self._catch_up.get(rule_id, 0)
+        ned = rule.next_execution_date
+        failed = False
+        if ned is not None and (remaining > 0 or ned <= time.time()):
+            previous = rule.last_executed
+            # Every catch-up firing but the last stands for one missed execution, keeping the
+            # rest of them overdue (reporting "now" could move the rule past its end_date)
+            rule.report_executed(rule.first_missed_execution(time.time()) if remaining > 1 else None)
+            try:
+                await self.callback(rule)
+            except Exception:
+                # Nothing was queued, the same execution is tried again
+                rule.last_executed = previous
+                failed = True
+                logger.error("Rule(label=%s) failed to execute, retrying in %ds", rule.label, Constants.RULE_RETRY_DELAY, exc_info=True)
+            else:
+                await self.report_executed_callback(rule)
+
+        # Only reschedule if the rule wasn't altered or removed while it was firing
+        if self._firing.get(rule_id) is asyncio.current_task():
+            del self._firing[rule_id]
+            if failed:
+                # Keeps the catch-up firings left, if any
+                self.schedule_at(rule_id, time.time() + Constants.RULE_RETRY_DELAY)
+            elif remaining > 1 and rule.next_execution_date is not None:
+                self._catch_up[rule_id] = remaining - 1
+                self.schedule_at(rule_id, self._next_slot(time.time()))
+            else:
+                if remaining > 1:
+                    # The rule ended before its remaining catch-up firings
+                    self.catch_up_stats["skipped"] += remaining - 1
+                self.schedule(rule)
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = self._pop_due(time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
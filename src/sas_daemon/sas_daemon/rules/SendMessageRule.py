@@ -18,71 +18,110 @@ dates and other info necessary for sending messages at certain intervals/dates.
 is part of the "SAS-Commons" module of the "SAS" project.
 '''
 from __future__ import annotations
-from typing import Callable, Coroutine, Any
-from datetime import datetime, timedelta
+from typing import Any
+from datetime import timedelta
 from ..datetimezone import datetimezone
 from ..templates import Template, PersonTemplateArguments
 from ..database import Database
-from .. import Constants
-import asyncio
-import logging
-
-logger = logging.getLogger("sas.daemon.rules")
 
 class SendMessageRule:
     def __init__(self, recipients:list[PersonTemplateArguments], template:Template,
-                 start_date:datetimezone, end_date:datetimezone|None = None,
-                 interval:timedelta|None = None, last_executed:datetimezone|None = None,
+                 start_date:int, end_date:int|None = None,
+                 interval:int = 0, last_executed:int|None = None,
                  id:int|None = None, label:str|None = None):
-        if end_date is not None and (start_date.get() >= end_date.get()):
-            raise ValueError(f"{self.__class__.__qualname__}: Constraint start_date({start_date.get()}) < end_date({end_date}): Failed.")
+        """A rule that sends a template to its recipients at `start_date` and every `interval` after it.
+
+        Args:
+            start_date (int): UTC epoch seconds.
+            end_date (int | None, optional): UTC epoch seconds, no executions happen after it.
+            interval (int, optional): Seconds between executions, 0 to execute once.
+            last_executed (int | None, optional): UTC epoch seconds.
+        """
+        if end_date is not None and (start_date >= end_date):
+            raise ValueError(f"{self.__class__.__qualname__}: Constraint start_date({start_date}) < end_date({end_date}): Failed.")
         # start_date and end_date are valid
         
-        if last_executed is not None and (start_date.get() > last_executed.get()):
-            raise ValueError(f"{self.__class__.__qualname__}: Constraint start_date({start_date.get()}) <= last_executed({last_executed.get()}): Failed")
-        if last_executed is not None and end_date is not None and (last_executed.get() > end_date.get()):
-            raise ValueError(f"{self.__class__.__qualname__}: Constraint last_executed({last_executed.get()}) <= end_date({end_date.get()}): Failed")
+        if last_executed is not None and (start_date > last_executed):
+            raise ValueError(f"{self.__class__.__qualname__}: Constraint start_date({start_date}) <= last_executed({last_executed}): Failed")
+        if last_executed is not None and end_date is not None and (last_executed > end_date):
+            raise ValueError(f"{self.__class__.__qualname__}: Constraint last_executed({last_executed}) <= end_date({end_date}): Failed")
         # last_executed is valid
 
 
-        self._start_date = start_date
-        self._end_date = end_date
-        self._interval = interval if interval is not None else timedelta()
-        self._last_executed = last_executed
+        self.start_date = start_date
+        self.end_date = end_date
+        self.interval = interval
+        self.last_executed = last_executed
         self.template = template
         self.recipients = recipients
         self.id = id
         self.label = label
 
     @property
-    def next_execution_date(self) -> datetimezone|None:
-        dtnow = datetimezone.now()
-
-        if self._last_executed is not None and self._interval == timedelta():
+    def next_execution_date(self) -> float|None:
+        """UTC epoch seconds of the next execution (now if it is overdue), None if there is none."""
+        if self.last_executed is not None and self.interval == 0:
             return None
 
         # If the starting date is in the future we don't need to add any intervals.
-        if self._last_executed is None:
-            if self._start_date.get() >= dtnow.get():
-                return self._start_date
-            else:
-                return dtnow
+        if self.last_executed is None:
+            now = datetimezone.now()
+            return self.start_date if self.start_date >= now else now
 
-        next_date = self._last_executed
-        if next_date is None:
-            next_date = self._start_date
-        # AT THIS POINT: next_date is a datetime with the last available known execution
-
-        next_date = datetimezone(next_date.get() + self._interval)
+        next_date = self.step(self.last_executed)
         # AT THIS POINT: next_date holds the next execution date (Could be in the past)
 
-        if self._end_date and next_date.get() > self._end_date.get():
-            if self._last_executed and self._last_executed.get() < self._end_date.get():
-                return self._end_date
+        if self.end_date is not None and next_date > self.end_date:
+            if self.last_executed < self.end_date:
+                return self.end_date
             else:
                 return None
         return next_date
-    
+
+    def step(self, timestamp:float, intervals:int = 1) -> float:
+        """`timestamp` plus `intervals` intervals.
+
+        Intervals of whole days are wall clock days of the display timezone, so a daily rule keeps
+        its time of day across DST changes. Shorter intervals are plain seconds.
+        """
+        if self.interval and self.interval % 86400 == 0:
+            return datetimezone.add_days(timestamp, intervals * (self.interval // 86400))
+        return timestamp + intervals * self.interval
+
+    def first_missed_execution(self, now:float) -> float|None:
+        """UTC epoch seconds of the oldest execution that was due by `now`, None if none is overdue."""
+        # next_execution_date reports an overdue first execution as "now", the missed one is start_date
+        first = self.start_date if self.last_executed is None else self.next_execution_date
+        return first if first is not None and first <= now else None
+
+    def missed_executions(self, now:float) -> int:
+        """Number of executions that were due by `now` and didn't happen."""
+        first = self.first_missed_execution(now)
+        if first is None:
+            return 0
+        if self.interval == 0:
+            return 1
+        last = now if self.end_date is None else min(now, self.end_date)
+        missed = max(int((last - first) // self.interval) + 1, 1)
+        # A DST change may move the executions of a daily rule by an hour around the estimate
+        while missed > 1 and self.step(first, missed - 1) > last:
+            missed -= 1
+        while self.step(first, missed) <= last:
+            missed += 1
+        return missed
+
+    def next_execution_after(self, now:float) -> float|None:
+        """UTC epoch seconds of the first execution after `now` that keeps the rule's schedule, skipping the missed ones."""
+        first = self.first_missed_execution(now)
+        if first is None:
+            return self.next_execution_date
+        if self.interval == 0:
+            return None
+        next_date = self.step(first, self.missed_executions(now))
+        if self.end_date is not None and next_date > self.end_date:
+            return None
+        return next_date
+
     def toJSON(self) -> dict[str, Any]:
         return {
             "id": self.id,
@@ -90,7 +129,7 @@ class SendMessageRule:
             "template": self.template.id,
             "start_date": self.str_start_date,
             "end_date": self.str_end_date,
-            "interval": self._interval.total_seconds(),
+            "interval": self.interval,
             "last_executed": self.str_last_executed,
             "label": self.label
         }
@@ -106,61 +145,52 @@ class SendMessageRule:
                             map(db.get_person, data["recipients"])))
         
         end_date:str|None = data.get("end_date", None)
-        interval:int = data.get('interval', 0)
+        interval:int|float = data.get('interval', 0)
         last_executed:str|None = data.get("last_executed", None)
         id:int|None = data.get("id", None)
         label:str|None = data.get("label", None)
 
+        # The API uses DATETIME_FORMAT strings in the display timezone
         return cls(
             recipients = recipients,
             template = template,
-            start_date = datetimezone(datetime.strptime(data['start_date'], Constants.DATETIME_FORMAT)),
-            end_date = datetimezone(datetime.strptime(end_date, Constants.DATETIME_FORMAT)) if end_date is not None else None,
-            interval = timedelta(seconds=interval),
-            last_executed = datetimezone(datetime.strptime(last_executed, Constants.DATETIME_FORMAT)) if last_executed is not None else None,
+            start_date = datetimezone.to_timestamp(data['start_date']),
+            end_date = datetimezone.to_timestamp(end_date) if end_date is not None else None,
+            interval = int(interval),
+            last_executed = datetimezone.to_timestamp(last_executed) if last_executed is not None else None,
             id = id,
             label = label
         )
     
     @property
     def str_start_date(self) -> str:
-        return self._start_date.get().strftime(Constants.DATETIME_FORMAT)
+        return datetimezone.from_timestamp(self.start_date)
     
     @property
     def str_end_date(self) -> str|None:
-        return self._end_date.get().strftime(Constants.DATETIME_FORMAT) if self._end_date else None
+        return datetimezone.from_timestamp(self.end_date) if self.end_date is not None else None
     
     @property
     def str_last_executed(self) -> str|None:
-        return self._last_executed.get().strftime(Constants.DATETIME_FORMAT) if self._last_executed else None
+        return datetimezone.from_timestamp(self.last_executed) if self.last_executed is not None else None
     
     @property
     def next_execution(self) -> timedelta|None:
-        dtnow = datetimezone.now()
-        # next_execution_date
         ned = self.next_execution_date
-
-        if not ned: return None
-        if dtnow.get() >= ned.get(): return timedelta() # 0
-        return ned.get() - dtnow.get()
+        if ned is None: return None
+        return timedelta(seconds=max(ned - datetimezone.now(), 0))
     
-    def report_executed(self):
-        self._last_executed = datetimezone.now()
-
-    async def schedule(self, callback:Callable[[SendMessageRule], Coroutine], report_executed_callback:Callable[[SendMessageRule], Coroutine]):
-        # Wait until execution
-        ne = self.next_execution
-        if ne and ne != timedelta(0):
-            logger.info("Rule(label=%s) scheduled for %s", self.label, (datetimezone.now().get() + ne).strftime(Constants.DATETIME_FORMAT))
-            await asyncio.sleep(ne.total_seconds())
-
-        # Prepare callback call
-        await asyncio.create_task(callback(self))
-
-        # update execution time
-        self.report_executed()
-        await asyncio.create_task(report_executed_callback(self))
-
-    async def infschedule(self, callback:Callable[[SendMessageRule], Coroutine], report_executed_callback:Callable[[SendMessageRule], Coroutine]):
-        while self.next_execution_date is not None:
-            await self.schedule(callback, report_executed_callback)
\ No newline at end of file
+    def report_executed(self, due:float|None = None):
+        """Record an execution, `due` is the missed execution it stands for (catch-up) or None for now."""
+        if due is not None:
+            # A missed execution is after last_executed and not after end_date
+            self.last_executed = int(due)
+            return
+
+        # Strictly increasing, it identifies the execution (see Database.enqueue_execution) even
+        # if the rule fires more than once per second (catch-up)
+        now = int(datetimezone.now())
+        self.last_executed = now if self.last_executed is None or now > self.last_executed else self.last_executed + 1
+        # A late execution must still satisfy last_executed <= end_date
+        if self.end_date is not None and self.last_executed > self.end_date:
+            self.last_executed = self.end_date
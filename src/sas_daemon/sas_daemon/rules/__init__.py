@@ -1 +1,2 @@
-from .SendMessageRule import SendMessageRule
\ No newline at end of file
+from .SendMessageRule import SendMessageRule
+from .RuleScheduler import RuleScheduler
\ No newline at end of file
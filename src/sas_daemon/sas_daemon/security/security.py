@@ -15,7 +15,14 @@ limitations under the License.
 '''
 from .user import User
 from ..database import Database
+from .. import Constants
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import argon2
+import hashlib
+import hmac
+import secrets
+import time
 import logging
 
 logger = logging.getLogger("sas.daemon.security")
@@ -24,13 +31,23 @@ class Security:
     def __init__(self, db:Database,
                  time_cost:int = argon2.DEFAULT_TIME_COST,
                  memory_cost:int = argon2.DEFAULT_MEMORY_COST,
-                 parallelism:int = argon2.DEFAULT_PARALLELISM):
+                 parallelism:int = argon2.DEFAULT_PARALLELISM,
+                 hash_workers:int = Constants.PASSWORD_HASH_WORKERS):
         self.db = db
         self.ph = argon2.PasswordHasher(
             time_cost=time_cost,
             memory_cost=memory_cost,
             parallelism=parallelism
         )
+
+        # argon2 releases the GIL, so threads are enough to keep hashing off the event loop.
+        # The number of workers caps the concurrent hashes (and the memory they use).
+        self.hash_executor = ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix="sas-argon2")
+
+        # Sessions only live in memory, a restart signs everyone out
+        self._session_key = secrets.token_bytes(32)
+        self._sessions:dict[str, tuple[User, float]] = {} # {token: (user, expires)}
+        self._next_purge = 0.0
     
     def check_password(self, user:User, password:str) -> bool:
         try:
@@ -44,11 +61,19 @@ class Security:
     def set_password(self, user:User, password:str):
         user.password = self.ph.hash(password)
     
-    def login(self, username:str, password:str, ip:str = '') -> User|None:
+    async def check_password_async(self, user:User, password:str) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.hash_executor, self.check_password, user, password)
+
+    async def set_password_async(self, user:User, password:str):
+        loop = asyncio.get_running_loop()
+        user.password = await loop.run_in_executor(self.hash_executor, self.ph.hash, password)
+    
+    async def login(self, username:str, password:str, ip:str = '') -> User|None:
         user = self.db.get_user(username)
 
         # Return None if user doesn't exist or password doesn't match
-        if user is None or not self.check_password(user, password):
+        if user is None or not await self.check_password_async(user, password):
             logger.warning("%s - %s: Authentication failed!", ip, username)
             return
         logger.info("%s - %s: Authentication successful!", ip, username)
@@ -56,8 +81,49 @@ class Security:
         # Rehash if needed
         if self.needs_rehash(user):
             logger.info("%s: Re-hashing password!", username)
-            self.set_password(user, password)
+            await self.set_password_async(user, password)
             self.db.alter_user(user)
         
         # Return the logged in user
-        return user
\ No newline at end of file
+        return user
+
+    def _sign(self, payload:str) -> str:
+        return hmac.new(self._session_key, payload.encode(), hashlib.sha256).hexdigest()
+
+    def create_session(self, user:User, lifetime:float = Constants.SESSION_LIFETIME) -> tuple[str, float]:
+        """Issue a signed session token for an authenticated user.
+
+        Returns:
+            tuple[str, float]: (token, expiration timestamp)
+        """
+        now = time.time()
+        if now >= self._next_purge:
+            self._sessions = {t: s for t, s in self._sessions.items() if s[1] > now}
+            self._next_purge = now + Constants.SESSION_PURGE_INTERVAL
+
+        expires = now + lifetime
+        payload = "%d.%d.%s" % (user.id, expires, secrets.token_urlsafe(16))
+        token = payload + "." + self._sign(payload)
+        self._sessions[token] = (user, expires)
+        return token, expires
+
+    def authenticate(self, token:str, ip:str = '') -> User|None:
+        """Find the user of a session token, without any password hashing."""
+        # The token comes straight from the JSON of a message, it may be any JSON value
+        if not isinstance(token, str):
+            logger.warning("%s: Invalid session token!", ip)
+            return
+        payload, _, signature = token.rpartition(".")
+        session = self._sessions.get(token)
+        if session is None or not hmac.compare_digest(signature, self._sign(payload)):
+            logger.warning("%s: Invalid session token!", ip)
+            return
+
+        user, expires = session
+        if expires <= time.time():
+            del self._sessions[token]
+            return
+        return user
+
+    def revoke_sessions(self, user:User):
+        self._sessions = {t: s for t, s in self._sessions.items() if s[0].id != user.id}
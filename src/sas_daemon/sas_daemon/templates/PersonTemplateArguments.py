@@ -22,12 +22,9 @@ from .TemplateArguments import TemplateArguments
 
 class PersonTemplateArguments(TemplateArguments):
     def __init__(self, *, telephone:str, id:int|None = None, first_name:str|None = None, last_name:str|None = None, address:str|None = None, **kwargs):
-        self.__dict__.update(kwargs)
-        self.telephone = telephone
-        self.id = id
-        self.first_name = first_name
-        self.last_name = last_name
-        self.address = address
+        # One __dict__ update instead of an assignment per field, each of which would go through the
+        # __setattr__ inherited from TemplateArguments; this is called once per loaded person
+        self.__dict__.update(kwargs, telephone=telephone, id=id, first_name=first_name, last_name=last_name, address=address)
     
     @classmethod
     def fromJSON(cls:type[PersonTemplateArguments], data:dict[str, Any]) -> PersonTemplateArguments:
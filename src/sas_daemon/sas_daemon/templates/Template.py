@@ -15,7 +15,7 @@ limitations under the License.
 '''
 from __future__ import annotations
 from .TemplateArguments import TemplateArguments
-from typing import Any
+from typing import Any, Iterable, Iterator
 
 
 
@@ -39,26 +39,32 @@ class Template:
         return placeholder_marks
     
     @staticmethod
-    def _compile_message(message:str, marks:list[tuple[int, int, str]], args:TemplateArguments):
-        offset = 0
-        # marks need to be in ascending order
-        for mark in marks:
-            val = getattr(args, mark[2], None)
-            if val is None:
-                continue
-                # raise TypeError("args doesn't have all the required attributes.")
+    def _compile_segments(message:str, marks:list[tuple[int, int, str]]) -> tuple[tuple[str, ...], tuple[tuple[int, str], ...]]:
+        """Split the message into literal text and placeholders.
 
-            message = message[:offset+mark[0]] + val + message[offset+mark[1]+1:]
-            placeholder_len = (mark[1] - mark[0])
-            val_len = len(val)
-            offset += val_len - placeholder_len - 1
-        return message
+        Returns:
+            tuple[tuple[str, ...], tuple[tuple[int, str], ...]]: The segments of the message (placeholders included
+            as they appear in the message) and the (segment index, attribute) of every placeholder.
+        """
+        segments:list[str] = []
+        fields:list[tuple[int, str]] = []
+        prevMarkEnd = 0
+        for mark in marks:
+            if mark[0] > prevMarkEnd:
+                segments.append(message[prevMarkEnd : mark[0]])
+            fields.append((len(segments), mark[2]))
+            segments.append(message[mark[0] : mark[1]+1])
+            prevMarkEnd = mark[1]+1
+        if prevMarkEnd < len(message) or not segments:
+            segments.append(message[prevMarkEnd:])
+        return tuple(segments), tuple(fields)
 
     def __init__(self, message:str, id:int|None = None, label:str|None = None):
         self.id = id
         self.label = label
         self._message = message
         self._marks = self._parse_message(message)
+        self._segments, self._fields = self._compile_segments(message, self._marks)
     
     def toJSON(self) -> dict[str, Any]:
         return {
@@ -75,9 +81,38 @@ class Template:
             label = data.get("label", None)
         )
     
-    def compileFor(self, args:TemplateArguments):
-        return self._compile_message(self._message, self._marks, args)
+    def compileFor(self, args:TemplateArguments) -> str:
+        # Placeholders without a value are left untouched
+        parts = list(self._segments)
+        for i, name in self._fields:
+            val = getattr(args, name, None)
+            if val is not None:
+                parts[i] = val
+        return "".join(parts)
+    
+    def compileMany(self, recipients:Iterable[TemplateArguments]) -> Iterator[tuple[TemplateArguments, str]]:
+        """Render the message for every recipient.
+
+        Yields:
+            tuple[TemplateArguments, str]: (recipient, message)
+        """
+        segments = self._segments
+        fields = self._fields
+        join = "".join
+        if not fields:
+            message = join(segments)
+            for args in recipients:
+                yield args, message
+            return
+
+        for args in recipients:
+            parts = list(segments)
+            for i, name in fields:
+                val = getattr(args, name, None)
+                if val is not None:
+                    parts[i] = val
+            yield args, join(parts)
     
     def compileWith(self, **kwargs):
         targs = TemplateArguments(**kwargs)
-        return self._compile_message(self._message, self._marks, targs)
\ No newline at end of file
+        return self.compileFor(targs)
\ No newline at end of file
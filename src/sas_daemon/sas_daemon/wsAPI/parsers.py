@@ -40,4 +40,44 @@ def parse_as_rule(db:Database, kwargs:dict[str, Any], id_required:bool = False)
     if id_required and id is None:
         raise TypeError("ID Required for object creation but is not present in the data")
         
-    return SendMessageRule.fromJSON(kwargs, db)
\ No newline at end of file
+    return SendMessageRule.fromJSON(kwargs, db)
+
+
+def parse_page(kwargs:dict[str, Any], sort_columns:dict[str, str|None], filters:tuple[str, ...] = ()) -> dict[str, Any]:
+    """Parse the pagination, sorting and filtering parameters of a listing.
+
+    Returns:
+        dict[str, Any]: Keyword arguments for the `Database.get_xxx` listings.
+    """
+    page:dict[str, Any] = {}
+    for name in ("limit", "offset", "after_id"):
+        value = kwargs.get(name, None)
+        if not isinstance(value, (int, type(None))): raise TypeError(f"Invalid {name.upper()} parameter")
+        page[name] = value
+
+    after = kwargs.get("after", None)
+    if not isinstance(after, (str, type(None))): raise TypeError("Invalid AFTER parameter")
+    page["after"] = after
+
+    sort = kwargs.get("sort", "id")
+    if sort not in sort_columns: raise TypeError("Invalid SORT parameter")
+    page["sort"] = sort
+
+    for name in filters:
+        value = kwargs.get(name, None)
+        if not isinstance(value, (str, type(None))): raise TypeError(f"Invalid {name.upper()} parameter")
+        page[name] = value
+    return page
+
+
+def next_cursor(results:list, page:dict[str, Any]) -> dict[str, Any]|None:
+    """The cursor of the page after `results`, None when `results` was the last page."""
+    limit = page["limit"]
+    if limit is None or len(results) < limit or not results:
+        return None
+
+    last = results[-1]
+    cursor:dict[str, Any] = {"after_id": last.id, "sort": page["sort"]}
+    if page["sort"] != "id":
+        cursor["after"] = getattr(last, page["sort"])
+    return cursor
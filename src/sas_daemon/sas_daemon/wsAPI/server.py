@@ -18,17 +18,33 @@ from ..database import Database
 from ..security import Security, User
 from ..templates import Template, PersonTemplateArguments
 from ..rules import SendMessageRule
+from ..importer import PeopleImport, iter_people_rows
+from ..cache import DatabaseCache
+from ..changefeed import Subscription, OBJECTS
+from ..api import SenderPool
 from .. import Constants
 from . import parsers
+from contextvars import ContextVar
+import contextlib
+import asyncio
+import io
 import json
 import websockets
 import logging
 
 logger = logging.getLogger("sas.daemon.wsapi")
 
+# The connection and request ID of the message that is being handled
+_connection:ContextVar[websockets.WebSocketServerProtocol] = ContextVar("connection")
+_request_id:ContextVar[Any] = ContextVar("request_id")
+
+
+class InvalidID(ValueError):
+    """The id of an object in a message isn't valid."""
+
 
 class WSAPI:
-    def __init__(self, db:Database, security:Security, host:str = "0.0.0.0", port:int = 8585):
+    def __init__(self, db:Database, security:Security, host:str = "0.0.0.0", port:int = 8585, cache:DatabaseCache|None = None):
         """WebSocket API
 
         To use this WS API send a JSON object:
@@ -40,18 +56,51 @@ class WSAPI:
             "parameters": {...}
         }
 
+        Instead of "username" and "password" a "token" may be used, it is returned by
+        the ["users", "login"] action and avoids hashing the password for every message.
+
         Where "action" is a list with identifiers (found in OPTIONS), it's basically a path to the endpoint.
         "parameters" is a dictionary with parameter-value pairs.
 
+        The "get" actions of templates, people and rules accept "stream": true, the results are
+        then sent as {"id": ..., "results": [...], "more": true} frames of at most WSAPI_STREAM_CHUNK_SIZE
+        results, followed by {"id": ..., "results": [], "more": false, "count": N}.
+
+        The messages of a connection are handled concurrently (up to WSAPI_CONNECTION_CONCURRENCY at a time),
+        so the responses may arrive in a different order than the requests. Only "alter" and "remove"
+        actions on the same object are guaranteed to be applied in the order they were received.
+
+        Several add/alter/remove actions of templates, people and rules can be sent in one message,
+        they are applied in a single transaction, all of them or none:
+        {
+            "id": ..., "token": ...,
+            "actions": [{"action": [...], "parameters": {...}}, ...]
+        }
+        The response is {"id": ..., "results": [one response per action]}, or
+        {"id": ..., "error": "batch-failed", "failed": index of the action that failed}.
+
+        An "alter" or "remove" action whose "id" parameter isn't an integer is answered with
+        {"id": ..., "error": "invalid-id"}.
+
+        The ["subscribe"] action (parameter "objects": a list of "template", "people", "rule", defaults to all)
+        pushes {"id": ..., "change": {...}} frames whenever an object changes, see `ChangeFeed` for the events.
+        A connection that falls too far behind is closed. ["unsubscribe"] ends the subscription.
+
         Args:
             db (Database): The database object to use.
             host (str, optional): The address to use to serve the server. Defaults to "0.0.0.0".
             port (int, optional): The port number to use for the server. Defaults to 8585.
+            cache (DatabaseCache | None, optional): The cache to keep up to date with the changes made through the API.
         """
         self.db = db
+        self.cache = cache if cache is not None else DatabaseCache(db)
+        # ["stats", "get"] reports each of these under its name
+        self.stats_sources:dict[str, Callable[[], dict]] = {"cache": self.cache.stats}
         self.security = security
         self.host = host
         self.port = port
+        self._object_locks:dict[tuple, list] = {} # key: [asyncio.Lock, number of users]
+        self._subscriptions:dict[websockets.WebSocketServerProtocol, tuple[Subscription, asyncio.Task]] = {}
         self.OPTIONS:dict[str, dict|Callable] = {
         "template": {
             "get": WSAPI.template_get,
@@ -63,7 +112,8 @@ class WSAPI:
             "get": WSAPI.people_get,
             "add": WSAPI.people_add,
             "alter": WSAPI.people_alter,
-            "remove": WSAPI.people_remove
+            "remove": WSAPI.people_remove,
+            "import": WSAPI.people_import
         },
         "rule": {
             "get": WSAPI.rule_get,
@@ -85,8 +135,15 @@ class WSAPI:
         },
         "telephone": {
             "get": WSAPI.telephone_get,
-            "alter": WSAPI.ignore # needs "telephone" parameter
-        }
+            "alter": WSAPI.ignore, # needs "telephone" parameter (comma separated sender numbers)
+            "add": WSAPI.ignore, # needs "telephone" parameter
+            "remove": WSAPI.ignore # needs "telephone" parameter
+        },
+        "stats": {
+            "get": WSAPI.stats_get
+        },
+        "subscribe": WSAPI.subscribe,
+        "unsubscribe": WSAPI.unsubscribe
     }
     
     async def start_server(self):
@@ -103,6 +160,48 @@ class WSAPI:
         except Exception:
             return None
 
+    # Actions that may be part of a batch, they must not suspend
+    BATCH_ACTIONS = {
+        (object_name, action)
+        for object_name in ("template", "people", "rule")
+        for action in ("add", "alter", "remove")
+    }
+
+    @staticmethod
+    def object_keys(packet:dict) -> list[tuple]:
+        """The objects a message modifies, messages with the same keys are handled in order.
+
+        A key is the object name and id, so an alter and a remove of the same object are ordered too.
+
+        Raises:
+            InvalidID: The id of an alter or remove action isn't an integer.
+        """
+        keys:set[tuple] = set()
+        for item in packet["actions"] if "actions" in packet else [packet]:
+            action = item["action"]
+            if action[-1] in ("alter", "remove"):
+                parameters = item.get("parameters", None)
+                id = parameters.get("id", None) if isinstance(parameters, dict) else None
+                if id is not None and (not isinstance(id, int) or isinstance(id, bool)):
+                    raise InvalidID(f"Invalid ID parameter of {action}: {id!r}")
+                keys.add((tuple(action[:-1]), id))
+        # A fixed order, so batches locking the same objects can't deadlock
+        return sorted(keys, key=repr)
+
+    @contextlib.asynccontextmanager
+    async def object_lock(self, key:tuple):
+        entry = self._object_locks.get(key)
+        if entry is None:
+            entry = self._object_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._object_locks[key]
+
     async def handle(self, ws:websockets.WebSocketServerProtocol):
         message:str
 
@@ -111,50 +210,174 @@ class WSAPI:
         except Exception:
             remote_host = 'UnknownIP'
 
-        async for message in ws: # type: ignore
-            try:
-                packet = json.loads(message)
-                user = self.security.login(packet["username"], packet["password"], remote_host)
-                if user is not None:
+        slots = asyncio.Semaphore(Constants.WSAPI_CONNECTION_CONCURRENCY)
+        tasks:set[asyncio.Task] = set()
+
+        try:
+            async for message in ws: # type: ignore
+                try:
+                    packet = json.loads(message)
+                    keys = self.object_keys(packet)
+                except InvalidID:
+                    # The id would be part of a lock key, the message can't be handled
+                    await ws.send(json.dumps({"error": "invalid-id", "id": packet.get("id", None)}))
+                    continue
+                except Exception:
+                    logger.error("%s - Invalid message: %s", remote_host, message, exc_info=True)
+                    continue
+
+                # Stop reading from the connection while it has too many requests in flight
+                await slots.acquire()
+                task = asyncio.create_task(self.handle_message(ws, remote_host, packet, keys))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: slots.release())
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.end_subscription(ws)
+            if tasks:
+                await asyncio.wait(tasks)
+
+    async def handle_message(self, ws:websockets.WebSocketServerProtocol, remote_host:str, packet:dict, keys:list[tuple]):
+        try:
+            _connection.set(ws)
+            _request_id.set(packet["id"])
+            # Tasks start in the order they were created and the locks are fair,
+            # so messages with the same keys acquire them in the order they were received.
+            async with contextlib.AsyncExitStack() as locks:
+                for key in keys:
+                    await locks.enter_async_context(self.object_lock(key))
+
+                if "token" in packet:
+                    user = self.security.authenticate(packet["token"], remote_host)
+                else:
+                    user = await self.security.login(packet["username"], packet["password"], remote_host)
+                if user is not None and "actions" in packet:
+                    res = self.run_batch(user, packet["actions"])
+                elif user is not None:
                     task = self.navigate_options(user, packet["action"], packet["parameters"])
                     res = await task # type: ignore
+                elif "token" in packet:
+                    res = {"error": "invalid-token"}
                 else:
                     res = {}
-                res["id"] = packet["id"]
-                res = json.dumps(res)
-                await ws.send(res)
-            except Exception:
-                logger.error("%s - %s", remote_host, json.dumps(packet), exc_info=True)
-                continue
+            res["id"] = packet["id"]
+            res = json.dumps(res)
+            await ws.send(res)
+        except websockets.ConnectionClosed:
+            pass
+        except Exception:
+            logger.error("%s - %s", remote_host, json.dumps(packet), exc_info=True)
+
+
+    @staticmethod
+    def run_now(coro:Coroutine[Any, Any, dict]) -> dict:
+        """Run an endpoint to completion without giving control to the event loop."""
+        try:
+            coro.send(None)
+        except StopIteration as e:
+            return e.value
+        coro.close()
+        raise RuntimeError("The action can't be part of a batch")
+
+    def run_batch(self, current_user:User, actions:list[dict]) -> dict:
+        """Run the actions of a batch in a single transaction, see `WSAPI`.
+
+        The actions run back to back without suspending, nothing else can write while the transaction is open.
+        """
+        results:list[dict] = []
+        try:
+            with self.db.transaction():
+                for item in actions:
+                    action = item["action"]
+                    if tuple(action) not in self.BATCH_ACTIONS:
+                        raise ValueError(f"Action {action} can't be part of a batch")
+
+                    task = self.navigate_options(current_user, action, item.get("parameters", {}))
+                    if task is None:
+                        raise ValueError(f"Unknown action {action}")
+                    res = self.run_now(task)
+                    # The endpoints report failures with an empty response
+                    if not res:
+                        raise RuntimeError(f"Action {action} failed")
+                    results.append(res)
+        except Exception:
+            # The endpoints update the cache as they go, forget what was rolled back
+            self.cache.clear()
+            logger.info("Batch rolled back at action %d", len(results), exc_info=True)
+            return {"error": "batch-failed", "failed": len(results)}
+        return {"results": results}
+
+    async def send_frame(self, frame:dict):
+        """Send an intermediate frame (e.g. progress) for the message that is being handled."""
+        ws = _connection.get(None)
+        if ws is None:
+            return
+        frame["id"] = _request_id.get(None)
+        await ws.send(json.dumps(frame))
+
+    async def stream_listing(self, fn:Callable[..., Any], page:dict[str, Any], chunk_size:int = Constants.WSAPI_STREAM_CHUNK_SIZE) -> dict:
+        """Send a listing as a sequence of frames instead of a single response.
+
+        The listing is read page by page with the keyset cursor, so only one chunk is in memory
+        and no reader connection is held while the client is receiving.
+        Sending waits for the socket's buffer to drain, a slow client slows down the reading.
+
+        Args:
+            fn (Callable[..., Any]): The Database listing (e.g. Database.get_people).
+            page (dict[str, Any]): The parsed listing parameters, see `parsers.parse_page`.
+            chunk_size (int, optional): Results per frame.
+
+        Returns:
+            dict: The final frame.
+        """
+        remaining:int|None = page["limit"]
+        query = dict(page)
+        count = 0
+        while remaining is None or remaining > 0:
+            query["limit"] = chunk_size if remaining is None else min(chunk_size, remaining)
+            results = await self.db.read(fn, **query)
+            if not results:
+                break
+
+            count += len(results)
+            if remaining is not None:
+                remaining -= len(results)
+            await self.send_frame({"results": [x.toJSON() for x in results], "more": True})
+
+            if len(results) < query["limit"]:
+                break
+            query["offset"] = None
+            query.update(parsers.next_cursor(results, query) or {})
+
+        return {"results": [], "more": False, "count": count}
 
-    
     async def template_get(self, current_user:User, **kwargs) -> dict:
         try:
             # get ID
             id:int|None = kwargs.get("id", None)
             if not isinstance(id, (int, type(None))): raise TypeError("Invalid ID parameter")
 
-            # get LIMIT
-            limit:int|None = kwargs.get("limit", None)
-            if not isinstance(limit, (int, type(None))): raise TypeError("Invalid LIMIT parameter")
-
-            # get OFFSET
-            offset:int|None = kwargs.get("offset", None)
-            if not isinstance(offset, (int, type(None))): raise TypeError("Invalid OFFSET parameter")
+            # get LIMIT/OFFSET or the cursor (AFTER_ID/AFTER), SORT and the filters
+            page = parsers.parse_page(kwargs, Database.TEMPLATE_SORT_COLUMNS, ("label_prefix",))
 
             # Fetch a single template or multiple templates
             results:list[Template] = []
             if id is not None:
-                res = self.db.get_template(id)
+                res = self.cache.get_template(id)
                 if res is not None:
                     results.append(res)
+            elif kwargs.get("stream", False) is True:
+                return await self.stream_listing(Database.get_templates, page)
             else:
-                results = self.db.get_templates(limit, offset)
+                results = await self.db.read(Database.get_templates, **page)
 
             return {
                 "results": list(map(
                     lambda x: x.toJSON(),
-                    results))
+                    results)),
+                "next_cursor": parsers.next_cursor(results, page) if id is None else None
             }
         except Exception:
             return {}
@@ -174,7 +397,10 @@ class WSAPI:
     async def template_alter(self, current_user:User, **kwargs) -> dict:
         try:
             template = parsers.parse_as_template(kwargs, True)
-            self.db.alter_template(template)
+            if self.db.alter_template(template) != 1:
+                self.cache.invalidate_template(template.id) # type: ignore
+                raise LookupError(f"Template with template.id = {template.id} doesn't exist")
+            self.cache.put_template(template)
 
             return {"status": "success"}
         except Exception:
@@ -186,6 +412,7 @@ class WSAPI:
             if not isinstance(id, int): raise TypeError("Invalid ID parameter")
 
             self.db.delete_template(id)
+            self.cache.invalidate_template(id)
             return {"status": "success"}
         except Exception:
             return {}
@@ -197,27 +424,25 @@ class WSAPI:
             id:int|None = kwargs.get("id", None)
             if not isinstance(id, (int, type(None))): raise TypeError("Invalid ID parameter")
 
-            # get LIMIT
-            limit:int|None = kwargs.get("limit", None)
-            if not isinstance(limit, (int, type(None))): raise TypeError("Invalid LIMIT parameter")
-
-            # get OFFSET
-            offset:int|None = kwargs.get("offset", None)
-            if not isinstance(offset, (int, type(None))): raise TypeError("Invalid OFFSET parameter")
+            # get LIMIT/OFFSET or the cursor (AFTER_ID/AFTER), SORT and the filters
+            page = parsers.parse_page(kwargs, Database.PEOPLE_SORT_COLUMNS, ("name_prefix", "telephone_prefix"))
 
             # Fetch a single template or multiple templates
             results:list[PersonTemplateArguments] = []
             if id is not None:
-                res = self.db.get_person(id)
+                res = self.cache.get_person(id)
                 if res is not None:
                     results.append(res)
+            elif kwargs.get("stream", False) is True:
+                return await self.stream_listing(Database.get_people, page)
             else:
-                results = self.db.get_people(limit, offset)
+                results = await self.db.read(Database.get_people, **page)
             
             return {
                 "results": list(map(
                     lambda x: x.toJSON(),
-                    results))
+                    results)),
+                "next_cursor": parsers.next_cursor(results, page) if id is None else None
             }
         except Exception:
             return {}
@@ -231,10 +456,39 @@ class WSAPI:
         except Exception:
             return {}
 
+    async def people_import(self, current_user:User, **kwargs) -> dict:
+        """Import many people at once.
+
+        Parameters:
+            "data": CSV or NDJSON text, large lists can be split over several requests.
+            "format": Either "csv" or "ndjson". Defaults to "csv".
+            "columns": The CSV columns, required when "data" doesn't start with a header line.
+
+        A {"progress": {...}} frame is sent after every inserted chunk.
+        """
+        try:
+            data:str = kwargs["data"]
+            if not isinstance(data, str): raise TypeError("Invalid DATA parameter")
+
+            format:str = kwargs.get("format", "csv")
+            columns:list[str]|None = kwargs.get("columns", None)
+            if not isinstance(columns, (list, type(None))): raise TypeError("Invalid COLUMNS parameter")
+
+            people_import = PeopleImport(self.db)
+            for progress in people_import.run(iter_people_rows(io.StringIO(data), format, columns)):
+                await self.send_frame({"progress": progress})
+
+            return people_import.result()
+        except Exception:
+            return {}
+
     async def people_alter(self, current_user:User, **kwargs) -> dict:
         try:
             person = parsers.parse_as_person(kwargs, True)
-            self.db.alter_person(person=person)
+            if self.db.alter_person(person=person) != 1:
+                self.cache.invalidate_person(person.id) # type: ignore
+                raise LookupError(f"Person with person.id = {person.id} doesn't exist")
+            self.cache.put_person(person)
             
             return {"status": "success"}
         except Exception:
@@ -246,6 +500,7 @@ class WSAPI:
             if not isinstance(id, int): raise TypeError("Invalid ID parameter")
 
             self.db.delete_person(id)
+            self.cache.invalidate_person(id)
             return {"status": "success"}
         except Exception:
             return {}
@@ -258,27 +513,25 @@ class WSAPI:
             id:int|None = kwargs.get("id", None)
             if not isinstance(id, (int, type(None))): raise TypeError("Invalid ID parameter")
 
-            # get LIMIT
-            limit:int|None = kwargs.get("limit", None)
-            if not isinstance(limit, (int, type(None))): raise TypeError("Invalid LIMIT parameter")
-
-            # get OFFSET
-            offset:int|None = kwargs.get("offset", None)
-            if not isinstance(offset, (int, type(None))): raise TypeError("Invalid OFFSET parameter")
+            # get LIMIT/OFFSET or the cursor (AFTER_ID/AFTER), SORT and the filters
+            page = parsers.parse_page(kwargs, Database.RULE_SORT_COLUMNS, ("label_prefix",))
 
             # Fetch a single template or multiple templates
             results:list[SendMessageRule] = []
             if id is not None:
-                res = self.db.get_rule(id)
+                res = await self.db.read(Database.get_rule, id)
                 if res is not None:
                     results.append(res)
+            elif kwargs.get("stream", False) is True:
+                return await self.stream_listing(Database.get_rules, page)
             else:
-                results = self.db.get_rules(limit, offset)
+                results = await self.db.read(Database.get_rules, **page)
 
             return {
                 "results": list(map(
                     lambda x: x.toJSON(),
-                    results))
+                    results)),
+                "next_cursor": parsers.next_cursor(results, page) if id is None else None
             }
         except Exception:
             return {}
@@ -295,8 +548,9 @@ class WSAPI:
     async def rule_alter(self, current_user:User, **kwargs) -> dict:
         try:
             rule = parsers.parse_as_rule(self.db, kwargs, True)
-            self.db.alter_rule(rule)
-            
+            if self.db.alter_rule(rule) != 1:
+                raise LookupError(f"Rule with rule.id = {rule.id} doesn't exist")
+
             return {"status": "success"}
         except Exception:
             return {}
@@ -313,7 +567,8 @@ class WSAPI:
 
     async def report_login(self, current_user:User, **kwargs) -> dict:
         try:
-            return {"status": "success"}
+            token, expires = self.security.create_session(current_user)
+            return {"status": "success", "token": token, "expires": expires}
         except Exception:
             return {}
     
@@ -323,10 +578,14 @@ class WSAPI:
             new_password = kwargs["new_password"]
             
             current_user.username = new_username
-            self.security.set_password(current_user, new_password)
+            await self.security.set_password_async(current_user, new_password)
 
             self.db.alter_user(current_user)
-            return {"status": "success"}
+
+            # Sign out every session of the user, the caller gets a new one
+            self.security.revoke_sessions(current_user)
+            token, expires = self.security.create_session(current_user)
+            return {"status": "success", "token": token, "expires": expires}
         except Exception:
             return {}
     
@@ -350,9 +609,62 @@ class WSAPI:
     async def telephone_get(self, current_user:User, **kwargs):
         try:
             telephone = self.db.get_setting(Constants.DATABASE_TELEPHONE_SETTING)
-            return {"telephone": telephone}
+            return {"telephone": telephone, "telephones": SenderPool.parse_numbers(telephone)}
         except Exception:
             return {}
     
+    async def stats_get(self, current_user:User, **kwargs) -> dict:
+        try:
+            return {name: source() for name, source in self.stats_sources.items()}
+        except Exception:
+            return {}
+    
+    async def subscribe(self, current_user:User, **kwargs) -> dict:
+        try:
+            objects:list[str]|None = kwargs.get("objects", None)
+            if objects is not None and (not isinstance(objects, list) or not set(objects) <= set(OBJECTS)):
+                raise TypeError("Invalid OBJECTS parameter")
+            if self.db.changes is None:
+                raise RuntimeError("The database doesn't publish changes")
+
+            ws = _connection.get()
+            self.end_subscription(ws)
+            subscription = self.db.changes.subscribe(objects)
+            task = asyncio.create_task(self.forward_changes(ws, subscription, _request_id.get(None)))
+            self._subscriptions[ws] = (subscription, task)
+            return {"status": "success"}
+        except Exception:
+            return {}
+
+    async def unsubscribe(self, current_user:User, **kwargs) -> dict:
+        ws = _connection.get(None)
+        if ws is None:
+            return {}
+        self.end_subscription(ws)
+        return {"status": "success"}
+
+    async def forward_changes(self, ws:websockets.WebSocketServerProtocol, subscription:Subscription, request_id:Any):
+        try:
+            while True:
+                change = await subscription.get()
+                if subscription.overflowed:
+                    await ws.close(1013, "Too many pending changes")
+                    return
+                await ws.send(json.dumps({"id": request_id, "change": change}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if self.db.changes is not None:
+                self.db.changes.unsubscribe(subscription)
+            if ws in self._subscriptions and self._subscriptions[ws][0] is subscription:
+                del self._subscriptions[ws]
+
+    def end_subscription(self, ws:websockets.WebSocketServerProtocol):
+        entry = self._subscriptions.pop(ws, None)
+        if entry is not None:
+            if self.db.changes is not None:
+                self.db.changes.unsubscribe(entry[0])
+            entry[1].cancel()
+
     async def ignore(self, current_user:User, **kwargs) -> dict:
         return {}
\ No newline at end of file
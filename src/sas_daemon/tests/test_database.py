@@ -0,0 +1,61 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from sas_daemon.database import Database
+from sas_daemon.templates import Template
+import pytest
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    return str(tmp_path / "sas.db")
+
+
+def labels(path:str) -> list[str|None]:
+    # What other connections see, that is what was committed
+    return [t.label for t in Database(path, readonly=True).get_templates()]
+
+
+def test_nested_transactions_commit_once(path):
+    db = Database(path)
+    committed:list[str] = []
+    with db.transaction():
+        db.add_template(Template("Hi", label="outer"))
+        with db.transaction():
+            db.add_template(Template("Hi", label="inner"))
+            db.on_commit(lambda: committed.append("inner"))
+        # The inner block ended, nothing is committed before the outer one does
+        assert labels(path) == [] and committed == []
+    assert labels(path) == ["outer", "inner"]
+    assert committed == ["inner"]
+
+
+def test_nested_transactions_roll_back_together(path):
+    db = Database(path)
+    committed:list[str] = []
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.add_template(Template("Hi", label="outer"))
+            with db.transaction():
+                db.add_template(Template("Hi", label="inner"))
+                db.on_commit(lambda: committed.append("inner"))
+                raise RuntimeError("Failed")
+    assert db.get_templates() == [] and committed == []
+
+    # The connection is usable again, writes outside of a transaction commit on their own
+    db.add_template(Template("Hi", label="after"))
+    db.on_commit(lambda: committed.append("after"))
+    assert labels(path) == ["after"]
+    assert committed == ["after"]
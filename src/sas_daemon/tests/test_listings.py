@@ -0,0 +1,88 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from sas_daemon.database import Database
+from sas_daemon.templates import Template, PersonTemplateArguments
+from sas_daemon.rules import SendMessageRule
+from sas_daemon.wsAPI import parsers
+from typing import Any, Callable
+import pytest
+
+# Duplicates, NULLs and names sharing a prefix, in no particular order
+NAMES = ["Maria", None, "Anna", "Maria", None, "Andreas", "Nikos", "Anna", None, "Manolis", "Andreas", "Eleni"]
+
+
+@pytest.fixture
+def db(tmp_path) -> Database:
+    db = Database(str(tmp_path / "sas.db"))
+    db.add_people([PersonTemplateArguments(telephone=f"+3069{i % 4}000000{i:02d}", first_name=name, last_name=NAMES[-1 - i])
+                   for i, name in enumerate(NAMES)])
+    for label in NAMES:
+        db.add_template(Template("Hi", label=label))
+    template = db.get_templates(limit=1)[0]
+    for label in NAMES:
+        db.add_rule(SendMessageRule([], template, 1_700_000_000, label=label))
+    return db
+
+
+def expected(objects:list, sort:str) -> list[int]:
+    # NULLs first, then by value, ties by id
+    if sort == "id":
+        return sorted(o.id for o in objects)
+    key:Callable[[Any], tuple] = lambda o: (getattr(o, sort) is not None, getattr(o, sort) or "", o.id)
+    return [o.id for o in sorted(objects, key=key)]
+
+
+def walk(listing:Callable[..., list], sort:str, limit:int, **filters) -> list[int]:
+    """Every id of a listing, page by page through the keyset cursor the API returns."""
+    page:dict[str, Any] = {"limit": limit, "sort": sort, **filters}
+    ids:list[int] = []
+    while True:
+        results = listing(**page)
+        ids += [o.id for o in results]
+        cursor = parsers.next_cursor(results, page)
+        if cursor is None:
+            return ids
+        page.update(cursor)
+
+
+@pytest.mark.parametrize("limit", [1, 2, 5, 100])
+@pytest.mark.parametrize("sort", Database.PEOPLE_SORT_COLUMNS)
+def test_people_pages(db, sort, limit):
+    assert walk(db.get_people, sort, limit) == expected(db.get_people(), sort)
+
+
+@pytest.mark.parametrize("limit", [1, 3])
+@pytest.mark.parametrize("sort", Database.PEOPLE_SORT_COLUMNS)
+@pytest.mark.parametrize("prefix", ["An", "Ma", "Z"])
+def test_people_pages_with_name_prefix(db, sort, limit, prefix):
+    people = [p for p in db.get_people() if any((name or "").startswith(prefix) for name in (p.first_name, p.last_name))]
+    assert walk(db.get_people, sort, limit, name_prefix=prefix) == expected(people, sort)
+
+
+@pytest.mark.parametrize("limit", [1, 2, 5])
+@pytest.mark.parametrize("sort", Database.TEMPLATE_SORT_COLUMNS)
+def test_template_pages(db, sort, limit):
+    assert walk(db.get_templates, sort, limit) == expected(db.get_templates(), sort)
+    labelled = [t for t in db.get_templates() if (t.label or "").startswith("An")]
+    assert walk(db.get_templates, sort, limit, label_prefix="An") == expected(labelled, sort)
+
+
+@pytest.mark.parametrize("limit", [1, 2, 5])
+@pytest.mark.parametrize("sort", Database.RULE_SORT_COLUMNS)
+def test_rule_pages(db, sort, limit):
+    assert walk(db.get_rules, sort, limit) == expected(db.get_rules(), sort)
+    labelled = [r for r in db.get_rules() if (r.label or "").startswith("An")]
+    assert walk(db.get_rules, sort, limit, label_prefix="An") == expected(labelled, sort)
@@ -0,0 +1,70 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from sas_daemon.database import Database
+from sas_daemon import migrations
+import sqlite3
+import re
+import pytest
+
+
+@pytest.fixture
+def conn(tmp_path) -> sqlite3.Connection:
+    # Database creates the tables and runs migrate()
+    return Database(str(tmp_path / "sas.db")).conn
+
+
+def query_plan(conn:sqlite3.Connection, query:str) -> str:
+    return "\n".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", (1,)))
+
+
+def test_migrate_is_idempotent(conn):
+    assert migrations.schema_version(conn) == len(migrations.MIGRATIONS)
+    assert migrations.migrate(conn) == len(migrations.MIGRATIONS)
+
+
+@pytest.mark.parametrize("query, index", [
+    ("SELECT `P`.`id` FROM `PeopleInRule` AS `PIR` JOIN `People` AS `P` ON `PIR`.`personID` = `P`.`id` WHERE `PIR`.`ruleID`=?", "PeopleInRule_ruleID"),
+    ("DELETE FROM `PeopleInRule` WHERE `ruleID`=?", "PeopleInRule_ruleID"),
+    ("SELECT `id` FROM `SendMessageRule` WHERE `templateID`=?", "SendMessageRule_templateID"),
+    ("SELECT `id` FROM `People` WHERE `telephone`=?", "People_telephone"),
+])
+def test_lookups_use_an_index(conn, query, index):
+    # e.g. "SEARCH PIR USING COVERING INDEX PeopleInRule_ruleID (ruleID=?)", not a SCAN of the table
+    plan = query_plan(conn, query)
+    assert re.search(rf"^SEARCH \w+ USING (COVERING )?INDEX {index} ", plan, re.MULTILINE), plan
+
+
+def test_legacy_dates_with_a_malformed_row(tmp_path):
+    path = str(tmp_path / "sas.db")
+    conn = Database(path).conn
+    # Back to schema version 2, the rule dates were DATETIME_FORMAT strings
+    conn.execute("PRAGMA user_version = 2;")
+    conn.execute("INSERT INTO `Templates` (`id`, `message`) VALUES (1, 'Hi');")
+    conn.executemany("INSERT INTO `SendMessageRule` (`id`, `templateID`, `start_date`, `end_date`, `interval`, `last_executed`) VALUES (?, 1, ?, ?, 60, ?);", [
+        (1, "2024-01-01 10:00:00.000000", None, "2024-01-01 10:01:00.000000"),
+        (2, "01/01/2024 10:00", "2024-02-01 10:00:00.000000", None),
+    ])
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    assert migrations.schema_version(db.conn) == len(migrations.MIGRATIONS)
+    rows = db.conn.execute("SELECT `id`, `start_date`, `end_date`, `last_executed` FROM `SendMessageRule` ORDER BY `id`;").fetchall()
+    # UTC is the default timezone
+    assert rows[0] == (1, 1704103200, None, 1704103260)
+    # The malformed date is kept for fixing, the other dates of the row are converted
+    assert rows[1] == (2, "01/01/2024 10:00", 1706781600, None)
+    assert [rule.id for rule in db.get_rules()] == [1]
@@ -0,0 +1,100 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from sas_daemon import Constants
+from sas_daemon.daemon import Daemon
+from sas_daemon.database import Database, OUTBOX_PENDING
+from sas_daemon.api import HTTPGatewayAPI, RateLimitedError, RateLimiter, SMSDispatcher
+from sas_daemon.mockgateway import MockGateway
+from sas_daemon.outbox import OutboxWorker
+from sas_daemon.templates import Template, PersonTemplateArguments
+from sas_daemon.rules import SendMessageRule
+import asyncio
+import time
+import pytest
+
+
+def test_repeated_catch_up_firings_queue_every_execution(tmp_path, monkeypatch):
+    monkeypatch.setattr(Constants, "DATABASE_FILE", str(tmp_path / "sas.db"))
+
+    async def run() -> Daemon:
+        daemon = Daemon()
+        template_id = daemon.db.add_template(Template("Hi $(first_name)"))
+        first, last = daemon.db.add_people([PersonTemplateArguments(telephone=f"+30690000000{i}", first_name=f"p{i}") for i in range(2)])
+        now = int(time.time())
+        # Every minute, last executed 10 minutes ago: 10 missed executions
+        recipients = [PersonTemplateArguments(id=id, telephone="") for id in range(first, last + 1)]
+        daemon.db.add_rule(SendMessageRule(recipients, Template("", id=template_id), now - 3600, interval=60, last_executed=now - 600))
+
+        # Wait for the report of the last firing instead of a fixed time
+        fired = 0
+        done = asyncio.Event()
+        report = daemon.scheduler.report_executed_callback
+
+        async def reported(rule:SendMessageRule):
+            nonlocal fired
+            await report(rule)
+            fired += 1
+            if fired == 3:
+                done.set()
+        daemon.scheduler.report_executed_callback = reported
+
+        # No ramp delay, the 3 firings happen within the same second
+        daemon.scheduler.catch_up(daemon.db.get_rules(with_recipients=False), "all", rate=0, window=0, max_firings=3)
+        task = asyncio.create_task(daemon.scheduler.run())
+        try:
+            await asyncio.wait_for(done.wait(), 5)
+        finally:
+            task.cancel()
+        return daemon
+
+    daemon = asyncio.run(run())
+    assert daemon.scheduler.stats()["catch_up"]["pending"] == 0
+    assert daemon.db.count_outbox() == {OUTBOX_PENDING: 3 * 2}
+
+
+def test_rate_limited_messages_are_postponed_without_an_attempt(tmp_path):
+    db = Database(str(tmp_path / "sas.db"))
+    db.enqueue_execution(1, 1_700_000_000, [(id, f"+30690000000{id}", "Hi") for id in range(3)])
+
+    # One message per minute, the batch of 3 is answered with 429 and "Retry-After: 120"
+    gateway = MockGateway(port=0, latency=0, rate=1 / 60, burst=1)
+    gateway.start()
+    try:
+        api = HTTPGatewayAPI(gateway.url, None, "+300")
+        worker = OutboxWorker(db, SMSDispatcher(limiter=RateLimiter(rate=0, limits={})), lambda: api, max_attempts=1)
+        now = time.time()
+        assert asyncio.run(worker.drain(api)) == 3
+    finally:
+        gateway.stop()
+
+    assert gateway.counters["rate_limited"] == 3
+    assert db.count_outbox() == {OUTBOX_PENDING: 3}
+    assert worker.postponed == 3 and worker.failed == 0
+    rows = db.conn.execute("SELECT `attempts`, `next_attempt` FROM `Outbox`;").fetchall()
+    for attempts, next_attempt in rows:
+        assert attempts == 0
+        assert next_attempt >= now + 120
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("120", 120.0),
+    ("-5", 0.0),
+    ("Wed, 21 Oct 2015 07:28:00 GMT", 0.0),
+    (None, None),
+    ("soon", None),
+])
+def test_retry_after(value, seconds):
+    assert RateLimitedError.parse_retry_after(value) == seconds
@@ -0,0 +1,85 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from sas_daemon.api import BasicAPI, SMSDispatcher
+from sas_daemon.api.RateLimiter import TokenBucket, RateLimiter
+import asyncio
+import time
+import pytest
+
+
+def bucket(rate:float, burst:int, now:float = 0.0) -> TokenBucket:
+    b = TokenBucket(rate, burst)
+    b.updated = now
+    return b
+
+
+def test_burst_is_free():
+    b = bucket(2, 3)
+    assert [b.reserve(0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+
+
+def test_reservations_over_the_burst_wait_in_order():
+    b = bucket(2, 1)
+    assert b.reserve(0.0) == 0.0
+    assert b.reserve(0.0) == pytest.approx(0.5)
+    assert b.reserve(0.0) == pytest.approx(1.0)
+
+
+def test_tokens_refill_up_to_the_burst():
+    b = bucket(2, 2)
+    b.reserve(0.0)
+    b.reserve(0.0)
+    assert b.reserve(0.5) == 0.0
+    # An hour idle saves up `burst` tokens, not more
+    assert [b.reserve(3600.0) for _ in range(3)] == [0.0, 0.0, pytest.approx(0.5)]
+
+
+def test_sender_limits():
+    limiter = RateLimiter(rate=1, burst=5, queue_size=10, limits={"+301": (10, 20)})
+    assert limiter.burst_of("+301") == 20
+    assert limiter.burst_of("+302") == 5
+    assert RateLimiter(rate=0, burst=5, queue_size=10, limits={}).burst_of("+301") == 2 ** 31
+
+
+class SlowGateway(BasicAPI):
+    sender = "+300"
+
+    def __init__(self):
+        self.sent:list[float] = []
+        self.release = asyncio.Event()
+
+    async def send_many(self, messages:list[tuple[str, str]]) -> list[BaseException|None]:
+        self.sent.append(time.monotonic())
+        if len(self.sent) <= 2:
+            await self.release.wait()
+        return [None] * len(messages)
+
+
+def test_chunks_held_by_the_concurrency_limit_keep_the_rate():
+    gateway = SlowGateway()
+    dispatcher = SMSDispatcher(concurrency=2, limiter=RateLimiter(rate=20, burst=1, queue_size=10, limits={}))
+
+    async def run():
+        batch = asyncio.create_task(dispatcher.send_batch(gateway, [(f"+30{i}", "Hi") for i in range(4)]))
+        # Both calls are taken, the next chunks wait for one
+        await asyncio.sleep(0.3)
+        gateway.release.set()
+        assert await batch == [None] * 4
+
+    asyncio.run(run())
+    assert len(gateway.sent) == 4
+    # Freed at the same moment, the waiting chunks still go out 1/rate apart
+    assert gateway.sent[3] - gateway.sent[2] >= 0.04
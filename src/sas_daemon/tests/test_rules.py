@@ -0,0 +1,94 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from sas_daemon import database # noqa: F401 (imported first, it breaks the import cycle with rules)
+from sas_daemon.templates import Template
+from sas_daemon.rules import SendMessageRule
+from sas_daemon.datetimezone import datetimezone
+import pytest
+import pytz
+
+START = 1_700_000_000
+
+
+def rule(interval:int = 0, last_executed:int|None = None, end_date:int|None = None) -> SendMessageRule:
+    return SendMessageRule([], Template(""), START, end_date=end_date, interval=interval, last_executed=last_executed)
+
+
+def test_nothing_missed_before_the_next_execution():
+    assert rule(interval=60).missed_executions(START - 1) == 0
+    r = rule(interval=60, last_executed=START)
+    assert r.missed_executions(START + 30) == 0
+    assert r.next_execution_after(START + 30) == START + 60
+
+
+def test_missed_executions_since_the_start():
+    r = rule(interval=60)
+    # START, +60, +120 and +180 were due
+    assert r.missed_executions(START + 200) == 4
+    assert r.next_execution_after(START + 200) == START + 240
+
+
+def test_missed_executions_since_the_last_execution():
+    r = rule(interval=60, last_executed=START + 60)
+    assert r.missed_executions(START + 119) == 0
+    assert r.missed_executions(START + 120) == 1
+    assert r.missed_executions(START + 600) == 9
+    assert r.next_execution_after(START + 600) == START + 660
+
+
+def test_missed_executions_stop_at_the_end_date():
+    r = rule(interval=60, end_date=START + 150)
+    # START, +60, +120; then the end date itself
+    assert r.missed_executions(START + 10_000) == 3
+    assert r.next_execution_after(START + 10_000) is None
+
+
+def test_a_one_off_rule_misses_once():
+    r = rule()
+    assert r.missed_executions(START + 10_000) == 1
+    assert r.next_execution_after(START + 10_000) is None
+    assert rule(last_executed=START).missed_executions(START + 10_000) == 0
+
+
+
+@pytest.fixture
+def athens(monkeypatch):
+    tz = pytz.timezone("Europe/Athens")
+    monkeypatch.setattr(datetimezone, "__timezone__", tz)
+    return tz
+
+
+def test_daily_rules_keep_their_time_of_day_across_dst(athens):
+    # 09:00 the day before the spring change (+2), then 09:00 in summer time (+3)
+    saturday = datetimezone.to_timestamp("2024-03-30 09:00:00.000000")
+    r = SendMessageRule([], Template(""), saturday, interval=86400, last_executed=saturday)
+    assert r.next_execution_date == saturday + 23 * 3600
+    assert datetimezone.from_timestamp(r.next_execution_date) == "2024-03-31 09:00:00.000000"
+
+    # Never executed, 09:00 each day from March 30 to April 6 was missed, (now - start) // 86400 is a day short
+    r = SendMessageRule([], Template(""), saturday, interval=86400)
+    now = datetimezone.to_timestamp("2024-04-06 09:30:00.000000")
+    assert r.missed_executions(now) == 8
+    assert r.missed_executions(now - 3600) == 7
+    assert datetimezone.from_timestamp(r.next_execution_after(now)) == "2024-04-07 09:00:00.000000"
+
+
+def test_shorter_intervals_are_plain_seconds(athens):
+    before = datetimezone.to_timestamp("2024-03-31 02:30:00.000000")
+    r = SendMessageRule([], Template(""), before, interval=3600, last_executed=before)
+    # 03:00-04:00 doesn't exist that night, an hour later is 04:30
+    assert r.next_execution_date == before + 3600
+    assert datetimezone.from_timestamp(r.next_execution_date) == "2024-03-31 04:30:00.000000"
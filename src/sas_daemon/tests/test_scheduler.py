@@ -0,0 +1,100 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from sas_daemon import database # noqa: F401 (imported first, it breaks the import cycle with rules)
+from sas_daemon import Constants
+from sas_daemon.templates import Template
+from sas_daemon.rules import SendMessageRule
+from sas_daemon.rules.RuleScheduler import RuleScheduler, CATCHUP_ALL
+import asyncio
+import time
+
+
+class Recorder:
+    """Runs a RuleScheduler over in memory rules and records the last_executed of every firing."""
+
+    def __init__(self, rules:list[SendMessageRule], firings:int):
+        self.rules = {rule.id: rule for rule in rules}
+        self.fired:list[int|None] = []
+        self.expected = firings
+        self.done = asyncio.Event()
+        self.scheduler = RuleScheduler(self.rules.get, self.callback, self.reported)
+
+    async def callback(self, rule:SendMessageRule):
+        self.fired.append(rule.last_executed)
+
+    async def reported(self, rule:SendMessageRule):
+        if len(self.fired) >= self.expected:
+            self.done.set()
+
+    async def run(self):
+        task = asyncio.create_task(self.scheduler.run())
+        try:
+            await asyncio.wait_for(self.done.wait(), 5)
+        finally:
+            task.cancel()
+
+
+def test_catch_up_of_a_rule_that_ended_during_the_outage():
+    now = int(time.time())
+    # Every minute for 31 minutes, ended 30 minutes ago, never executed
+    start = now - 3600
+    rule = SendMessageRule([], Template(""), start, end_date=start + 1800, interval=60, id=1)
+
+    async def run() -> Recorder:
+        recorder = Recorder([rule], 5)
+        stats = recorder.scheduler.catch_up([rule], CATCHUP_ALL, rate=0, window=0, max_firings=5)
+        assert stats["skipped"] == 31 - 5
+        await recorder.run()
+        return recorder
+
+    recorder = asyncio.run(run())
+    # Each firing but the last stands for its missed execution, the last one ends the rule
+    assert recorder.fired == [start, start + 60, start + 120, start + 180, start + 1800]
+    assert recorder.scheduler.stats()["catch_up"]["pending"] == 0
+    assert rule.next_execution_date is None
+    assert 1 not in recorder.scheduler
+
+
+def test_a_failed_execution_is_retried():
+    now = int(time.time())
+    once = SendMessageRule([], Template(""), now - 60, id=1)
+    repeating = SendMessageRule([], Template(""), now - 3600, interval=60, last_executed=now - 60, id=2)
+    executed:list[int] = []
+
+    async def callback(rule:SendMessageRule):
+        raise RuntimeError("The database is locked")
+
+    async def reported(rule:SendMessageRule):
+        assert rule.id is not None
+        executed.append(rule.id)
+
+    async def run() -> RuleScheduler:
+        rules = {1: once, 2: repeating}
+        scheduler = RuleScheduler(rules.get, callback, reported)
+        scheduler.schedule(once)
+        scheduler.schedule(repeating)
+        scheduler._pop_due(time.time())
+        await asyncio.gather(*scheduler._tasks)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert executed == []
+    # Nothing moved forward, both rules are due again after RULE_RETRY_DELAY
+    assert once.last_executed is None
+    assert repeating.last_executed == now - 60
+    assert 1 in scheduler and 2 in scheduler
+    assert scheduler._due[1] >= now + Constants.RULE_RETRY_DELAY
+    assert scheduler._due[2] >= now + Constants.RULE_RETRY_DELAY
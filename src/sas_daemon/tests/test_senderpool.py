@@ -0,0 +1,97 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from sas_daemon import Constants
+from sas_daemon.daemon import Daemon
+from sas_daemon.api import BasicAPI, SenderPool
+from sas_daemon.api.SenderPool import STICKY, LEAST_LOADED
+from collections import Counter
+import asyncio
+import pytest
+
+RECIPIENTS = [f"+30690{i:07d}" for i in range(4000)]
+
+
+class Sender(BasicAPI):
+    def __init__(self, sender:str):
+        self.sender = sender
+
+
+def senders(*numbers:str) -> list[BasicAPI]:
+    return [Sender(number) for number in numbers]
+
+
+def test_sticky_picks_are_stable_and_balanced():
+    pool = SenderPool(senders("+301", "+302", "+303", "+304"), STICKY)
+    picks = {telephone: pool.pick(telephone).sender for telephone in RECIPIENTS}
+    assert all(pool.pick(telephone).sender == sender for telephone, sender in picks.items())
+    # A new pool with the same numbers, in any order (e.g. after a restart), picks the same way
+    reordered = SenderPool(senders("+304", "+303", "+302", "+301"), STICKY)
+    assert all(reordered.pick(telephone).sender == sender for telephone, sender in picks.items())
+    counts = Counter(picks.values())
+    assert len(counts) == 4 and min(counts.values()) > len(RECIPIENTS) / 4 * 0.85
+
+
+def test_removing_a_number_only_moves_its_recipients():
+    before = SenderPool(senders("+301", "+302", "+303", "+304"), STICKY)
+    after = SenderPool(senders("+301", "+302", "+304"), STICKY)
+    for telephone in RECIPIENTS:
+        sender = before.pick(telephone).sender
+        if sender != "+303":
+            assert after.pick(telephone).sender == sender
+
+
+def test_least_loaded_picks_the_idle_sender_then_round_robin():
+    load = {"+301": 5, "+302": 0, "+303": 0}
+    pool = SenderPool(senders("+301", "+302", "+303"), LEAST_LOADED, load.get) # type: ignore
+    assert [pool.pick(t).sender for t in RECIPIENTS[:4]] == ["+302", "+303", "+302", "+303"]
+    load["+303"] = 9
+    assert [pool.pick(t).sender for t in RECIPIENTS[:2]] == ["+302", "+302"]
+    with pytest.raises(ValueError):
+        SenderPool(senders("+301"), LEAST_LOADED)
+
+
+def test_telephone_endpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(Constants, "DATABASE_FILE", str(tmp_path / "sas.db"))
+    monkeypatch.setattr(Constants, "SMS_GATEWAY", "http")
+
+    async def run():
+        daemon = Daemon()
+        wsapi = daemon.wsapi
+
+        def numbers() -> list[str|None]:
+            pool = daemon.sms_gateway
+            return [gateway.sender for gateway in pool.gateways] if isinstance(pool, SenderPool) else []
+
+        daemon.reload_gateway()
+        assert daemon.sms_gateway is None
+
+        assert await daemon.add_telephone(wsapi, None, telephone="+301, +302") == {"status": "success"} # type: ignore
+        # Numbers already in the pool (spaces don't matter) aren't added again
+        assert await daemon.add_telephone(wsapi, None, telephone="+30 2,+303") == {"status": "success"} # type: ignore
+        assert numbers() == ["+301", "+302", "+303"]
+        assert await daemon.add_telephone(wsapi, None, telephone=" , ") == {} # type: ignore
+
+        assert await daemon.remove_telephone(wsapi, None, telephone="+30 2") == {"status": "success"} # type: ignore
+        assert await daemon.remove_telephone(wsapi, None, telephone="+309") == {} # type: ignore
+        assert numbers() == ["+301", "+303"]
+        assert daemon.db.get_setting(Constants.DATABASE_TELEPHONE_SETTING) == "+301,+303"
+
+        assert await daemon.update_telephone(wsapi, None, telephone="+304") == {"status": "success"} # type: ignore
+        assert numbers() == ["+304"]
+        assert await daemon.remove_telephone(wsapi, None, telephone="+304") == {"status": "success"} # type: ignore
+        assert daemon.sms_gateway is None and daemon.db.get_setting(Constants.DATABASE_TELEPHONE_SETTING) is None
+
+    asyncio.run(run())
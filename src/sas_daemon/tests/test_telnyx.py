@@ -0,0 +1,48 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from sas_daemon.api import TelnyxAPI, RateLimitedError
+import asyncio
+import telnyx
+
+
+class APIError(Exception):
+    def __init__(self, http_status:int, headers:dict[str, str]):
+        super().__init__(f"Request failed ({http_status})")
+        self.http_status = http_status
+        self.headers = headers
+
+
+class Message:
+    errors = {
+        "+301": APIError(429, {"Retry-After": "30"}),
+        "+302": APIError(500, {}),
+    }
+
+    @classmethod
+    def create(cls, to:str, **kwargs):
+        if to in cls.errors:
+            raise cls.errors[to]
+        return {"to": to}
+
+
+def test_throttled_messages_are_rate_limited(monkeypatch):
+    monkeypatch.setattr(telnyx, "Message", Message, raising=False)
+    api = TelnyxAPI("key", "+300")
+
+    sent, throttled, failed = asyncio.run(api.send_many([("+303", "Hi"), ("+301", "Hi"), ("+302", "Hi")]))
+    assert sent is None
+    assert isinstance(throttled, RateLimitedError) and throttled.retry_after == 30
+    assert failed is Message.errors["+302"]
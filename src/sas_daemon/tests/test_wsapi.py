@@ -0,0 +1,156 @@
+'''
+Copyright 2024 Jim Konstantos <konstantosjim@gmail.com>
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+'''
+from sas_daemon import Constants
+from sas_daemon.daemon import Daemon
+from sas_daemon.changefeed import UPDATED
+from sas_daemon.templates import Template, PersonTemplateArguments
+from sas_daemon.rules import SendMessageRule
+from sas_daemon.datetimezone import datetimezone
+from sas_daemon.wsAPI.server import WSAPI
+import asyncio
+import json
+import time
+
+
+def test_alter_and_remove_of_an_object_share_a_lock():
+    alter = WSAPI.object_keys({"action": ["people", "alter"], "parameters": {"id": 3}})
+    remove = WSAPI.object_keys({"action": ["people", "remove"], "parameters": {"id": 3}})
+    assert alter == remove
+
+
+def test_batch_locks_each_object_once():
+    keys = WSAPI.object_keys({"actions": [
+        {"action": ["people", "alter"], "parameters": {"id": 3}},
+        {"action": ["people", "remove"], "parameters": {"id": 3}},
+        {"action": ["template", "remove"], "parameters": {"id": 3}},
+        {"action": ["people", "add"], "parameters": {}},
+    ]})
+    assert len(keys) == 2
+
+
+def test_alter_of_a_missing_object_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(Constants, "DATABASE_FILE", str(tmp_path / "sas.db"))
+
+    async def run():
+        daemon = Daemon()
+        wsapi, db = daemon.wsapi, daemon.db
+        assert db.changes is not None
+        changes = db.changes.subscribe()
+        person_id = db.add_person(PersonTemplateArguments(telephone="+306900000000"))
+        template_id = db.add_template(Template("Hi"))
+        while not changes.queue.empty():
+            changes.queue.get_nowait()
+
+        assert WSAPI.run_now(wsapi.people_alter(None, id=person_id + 1, telephone="+306900000001")) == {}
+        assert WSAPI.run_now(wsapi.template_alter(None, id=template_id + 1, message="Bye")) == {}
+        assert wsapi.cache.get_person(person_id + 1) is None
+        assert wsapi.cache.get_template(template_id + 1) is None
+        assert changes.queue.empty()
+
+        assert WSAPI.run_now(wsapi.people_alter(None, id=person_id, telephone="+306900000001")) == {"status": "success"}
+        assert wsapi.cache.get_person(person_id).telephone == "+306900000001"
+        assert changes.queue.get_nowait()["event"] == UPDATED
+
+    asyncio.run(run())
+
+
+class Connection:
+    """Collects the frames WSAPI sends."""
+
+    def __init__(self, messages:list[str]|None = None):
+        self.messages = messages or []
+        self.sent:list[dict] = []
+
+    async def send(self, frame:str):
+        self.sent.append(json.loads(frame))
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for message in self.messages:
+            yield message
+
+
+def test_invalid_token_types_are_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(Constants, "DATABASE_FILE", str(tmp_path / "sas.db"))
+
+    async def run() -> list[dict]:
+        wsapi = Daemon().wsapi
+        ws = Connection()
+        for id, token in enumerate([None, 42, {"token": "x"}, ["x"], "x.y"]):
+            packet = {"id": id, "token": token, "action": ["template", "get"], "parameters": {}}
+            await wsapi.handle_message(ws, "test", packet, WSAPI.object_keys(packet)) # type: ignore
+        return ws.sent
+
+    assert asyncio.run(run()) == [{"id": id, "error": "invalid-token"} for id in range(5)]
+
+
+def test_ids_that_cant_be_locked_are_answered(tmp_path, monkeypatch):
+    monkeypatch.setattr(Constants, "DATABASE_FILE", str(tmp_path / "sas.db"))
+    messages = [
+        {"id": 1, "token": "x", "action": ["people", "remove"], "parameters": {"id": [1, 2]}},
+        {"id": 2, "token": "x", "actions": [{"action": ["template", "alter"], "parameters": {"id": {"a": 1}}}]},
+        {"id": 3, "token": "x", "action": ["people", "remove"], "parameters": {"id": 1}},
+    ]
+
+    async def run() -> list[dict]:
+        ws = Connection([json.dumps(message) for message in messages])
+        await Daemon().wsapi.handle(ws) # type: ignore
+        return ws.sent
+
+    assert asyncio.run(run()) == [
+        {"id": 1, "error": "invalid-id"},
+        {"id": 2, "error": "invalid-id"},
+        {"id": 3, "error": "invalid-token"},
+    ]
+
+
+def test_a_failed_batch_is_rolled_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(Constants, "DATABASE_FILE", str(tmp_path / "sas.db"))
+
+    async def run():
+        daemon = Daemon()
+        wsapi, db, scheduler = daemon.wsapi, daemon.db, daemon.scheduler
+        person_id = db.add_person(PersonTemplateArguments(telephone="+306900000000"))
+        template_id = db.add_template(Template("Hi"))
+        old_rule = db.add_rule(SendMessageRule([], Template("", id=template_id), int(time.time()) + 3600))
+        scheduler.schedule(db.get_rule(old_rule))
+        assert wsapi.cache.get_person(person_id).telephone == "+306900000000"
+
+        start = datetimezone.from_timestamp(time.time() + 3600)
+        actions = [
+            {"action": ["people", "alter"], "parameters": {"id": person_id, "telephone": "+306911111111"}},
+            {"action": ["rule", "add"], "parameters": {"template": template_id, "recipients": [person_id], "start_date": start}},
+            {"action": ["rule", "remove"], "parameters": {"id": old_rule}},
+            {"action": ["template", "alter"], "parameters": {"id": template_id + 1, "message": "Bye"}},
+        ]
+        assert wsapi.run_batch(None, actions) == {"error": "batch-failed", "failed": 3} # type: ignore
+
+        # Database, cache and scheduler are as they were before the batch
+        assert db.get_person(person_id).telephone == "+306900000000"
+        assert wsapi.cache.get_person(person_id).telephone == "+306900000000"
+        assert [rule.id for rule in db.get_rules()] == [old_rule]
+        assert old_rule in scheduler and len(scheduler) == 1
+
+        # The same batch without the failing action is applied as a whole
+        res = wsapi.run_batch(None, actions[:-1]) # type: ignore
+        new_rule = res["results"][1]["added_id"]
+        assert wsapi.cache.get_person(person_id).telephone == "+306911111111"
+        assert [rule.id for rule in db.get_rules()] == [new_rule]
+        assert new_rule in scheduler and old_rule not in scheduler
+
+    asyncio.run(run())